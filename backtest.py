@@ -1,8 +1,64 @@
+import os
+from typing import List
+
 from instrument import *
-from log import logger
+from log import INFO, Logger
 from price import *
 from strategy import OptionStrategy, Trade
-from tick import MarketDataLoader
+from tick import MarketDataLoader, TickData
+
+
+def match_orders(strategy: OptionStrategy, pricer: Pricer, tick: TickData):
+    """
+    Match the strategy's resting orders against the current tick, in order id order.
+    Only stock orders within the bar's range and option orders are looked at.
+    """
+    book = strategy.order_book
+    if not book:
+        return
+    candidates = book.stock_orders_within(tick.stock_price.low, tick.stock_price.high)
+    candidates.extend(book.option_orders.values())
+    candidates.sort(key=lambda order: order.id)
+    for order in candidates:
+        strategy.logger.info("Order %s", order)
+        if order.is_option:
+            if order.instrument.expiration <= tick.time:
+                # the contract expired before the order filled
+                strategy.cancel_order(order.id)
+                continue
+            # option orders: fill at market bbo, limits only if the market is at or better
+            premium = pricer.market_price_or_theo(order.instrument, strategy.logger)
+            if order.price > 0 and (premium > order.price if order.buy else premium < order.price):
+                continue
+            trade = Trade(order, premium, order.qty)
+        else:
+            # stock orders: the bar traded through the limit
+            trade = Trade(order, order.price, order.qty)
+        # notify strategy when filled
+        book.cancel(order.id)
+        strategy.trades.append(trade)
+        strategy.fill_event(trade)
+
+
+def settle_options(strategy: OptionStrategy, tick: TickData):
+    """
+    EOD settlement: assign ITM options expiring today, then notify market close.
+    """
+    # check assigned / expired options
+    expired_trades = []
+    for trade in strategy.trades_option_open.expiring(tick.day):
+        assert trade.order.is_option
+        option = trade.order.instrument
+        itm = (option.call and tick.stock_price.close >= option.strike) or (
+            not option.call and tick.stock_price.close <= option.strike)
+        if itm:
+            strategy.assignment_event(
+                trade, tick.stock_price.close)
+        else:
+            expired_trades.append(trade)
+    # notify market close
+    strategy.close_event(expired_trades)
+    strategy.log_stats()
 
 
 def backtest(strategy: OptionStrategy, pricer: Pricer, md: MarketDataLoader):
@@ -10,54 +66,54 @@ def backtest(strategy: OptionStrategy, pricer: Pricer, md: MarketDataLoader):
     Run the backtest for the given strategy.
     This function is called in the main block.
     """
-    logger.open(f"tmp/{strategy.name}.log")
+    backtest_many([strategy], pricer, md, f"tmp/{strategy.name}.log")
+
+
+def backtest_many(strategies: List[OptionStrategy], pricer: Pricer, md: MarketDataLoader,
+                  log_path: str = "tmp/backtest.log", strategy_logs: bool = False,
+                  log_level: int = INFO):
+    """
+    Run the backtest for all given strategies in a single pass over the ticks.
+    Tick decoding, pricer updates and EOD detection are shared by all strategies,
+    each strategy sees exactly the same events as in a standalone backtest.
+
+    Logs go to a logger owned by this run, so runs in other threads do not clobber
+    each other. With strategy_logs, each strategy logs to {name}.log next to log_path.
+    """
+    run_logger = Logger(log_level)
+    run_logger.open(log_path)
+    loggers = [run_logger]
+    pricer.logger = run_logger
+    for strategy in strategies:
+        if strategy_logs:
+            strategy.logger = Logger(log_level)
+            strategy.logger.open(os.path.join(
+                os.path.dirname(log_path), f"{strategy.name}.log"))
+            loggers.append(strategy.logger)
+        else:
+            strategy.logger = run_logger
+    try:
+        _replay(strategies, pricer, md, loggers)
+    finally:
+        for logger in loggers:
+            logger.close()
+
+
+def _replay(strategies: List[OptionStrategy], pricer: Pricer, md: MarketDataLoader,
+            loggers: List[Logger]):
     while md.has_next_tick:
         tick = md.next_tick()
-        logger.settime(tick.time)
-        # feed latest val to pricer and strategy
-        pricer.val_event(tick.time, tick.stock_price.open)
-        strategy.tick_event(tick.time, tick.stock_price.open)
-        # check strategy orders
-        remaining_orders = []
-        for order in strategy.pending_orders:
-            logger.info(f"Order {order}")
-            trade = None
-            if order.is_option:
-                # option orders: always fill at market bbo
-                # TODO: support limit option orders
-                premium = pricer.market_price_or_theo(order.instrument)
-                trade = Trade(order, premium, order.qty)
-            else:
-                # stock orders: check for price limit
-                can_be_filled = (
-                    order.price >= tick.stock_price.low and order.price <= tick.stock_price.high)
-                if can_be_filled:
-                    trade = Trade(order, order.price, order.qty)
-                else:
-                    remaining_orders.append(order)
-            # notify strategy when filled
-            if trade:
-                strategy.trades.append(trade)
-                strategy.fill_event(trade)
-        strategy.pending_orders = remaining_orders
+        for logger in loggers:
+            logger.settime(tick.time)
+        # feed latest val and quotes to pricer and strategies
+        pricer.val_event(tick.time, tick.stock_price.open, tick)
+        for strategy in strategies:
+            strategy.tick_event(tick.time, tick.stock_price.open, tick)
+            # check strategy orders
+            match_orders(strategy, pricer, tick)
         # feed full tick data to pricer
         pricer.tick_event(tick)
         # EOD events
         if md.end_of_day:
-            # check assigned / expired options
-            expired_trades = []
-            for trade in strategy.trades_option_open:
-                assert trade.order.is_option
-                if trade.order.instrument.expiration.date() <= tick.time.date():
-                    option = trade.order.instrument
-                    itm = (option.call and tick.stock_price.close >= option.strike) or (
-                        not option.call and tick.stock_price.close <= option.strike)
-                    if itm:
-                        strategy.assignment_event(
-                            trade, tick.stock_price.close)
-                    else:
-                        expired_trades.append(trade)
-            # notify market close
-            strategy.close_event(expired_trades)
-            strategy.log_stats()
-    logger.close()
+            for strategy in strategies:
+                settle_options(strategy, tick)
@@ -0,0 +1,175 @@
+import csv
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import dataclass
+
+import numpy as np
+
+CACHE_DIR = "data/.cache"
+CACHE_VERSION = 1
+
+
+@dataclass
+class StockColumns:
+    """
+    Columnar stock bars, one entry per CSV row.
+    """
+    time: np.ndarray  # int64 epoch seconds
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+
+@dataclass
+class OptionColumns:
+    """
+    Columnar option quotes, one entry per CSV row.
+    Contract symbols are interned: `symbol` indexes into `symbols`.
+    """
+    time: np.ndarray  # int64 epoch seconds
+    symbol: np.ndarray  # int32 index into symbols
+    bid: np.ndarray
+    ask: np.ndarray
+    last: np.ndarray
+    iv: np.ndarray
+    volume: np.ndarray  # int64
+    symbols: np.ndarray  # str table
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+
+STOCK_FIELDS = ["time", "open", "high", "low", "close"]
+OPTION_FIELDS = ["time", "symbol", "bid", "ask",
+                 "last", "iv", "volume", "symbols"]
+
+
+def _cache_path(filename: str) -> str:
+    """
+    Cache directory for a source file, keyed by its path, size and mtime.
+    Any change to the source file results in a new cache entry, the stale
+    entries of the same file are pruned when it is written.
+    """
+    stat = os.stat(filename)
+    key = f"{os.path.abspath(filename)}:{stat.st_size}:{stat.st_mtime_ns}:{CACHE_VERSION}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"{os.path.basename(filename)}-{digest}")
+
+
+def _save(path: str, columns: dict[str, np.ndarray], source: str):
+    """
+    Write columns as .npy files. Written to a temp dir first and renamed,
+    so a crashed or concurrent conversion never leaves a partial entry.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, array in columns.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"source": os.path.abspath(source), "rows": len(columns["time"])}, f)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process finished the same conversion first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+    _prune(path, source)
+
+
+def _prune(path: str, source: str):
+    """
+    Delete the cache entries of older versions of source, e.g. of a CSV the
+    scraper keeps appending to. Readers keep their mmaps of deleted entries.
+    """
+    source = os.path.abspath(source)
+    prefix = f"{os.path.basename(source)}-"
+    for name in os.listdir(CACHE_DIR):
+        entry = os.path.join(CACHE_DIR, name)
+        if not name.startswith(prefix) or ".tmp-" in name or entry == path:
+            continue
+        try:
+            with open(os.path.join(entry, "meta.json"), "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # older entries may hold the path as given, resolved against the working directory
+        if os.path.abspath(meta.get("source", "")) == source:
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def _load(path: str, fields: list[str]) -> dict[str, np.ndarray]:
+    return {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+        for name in fields
+    }
+
+
+def _parse_stock_csv(filename: str) -> dict[str, np.ndarray]:
+    time, open_, high, low, close = [], [], [], [], []
+    with open(filename, 'r') as f:
+        for row in csv.DictReader(f):
+            time.append(int(row['time']))
+            open_.append(float(row['open']))
+            high.append(float(row['high']))
+            low.append(float(row['low']))
+            close.append(float(row['close']))
+    return {
+        "time": np.array(time, dtype=np.int64),
+        "open": np.array(open_, dtype=np.float64),
+        "high": np.array(high, dtype=np.float64),
+        "low": np.array(low, dtype=np.float64),
+        "close": np.array(close, dtype=np.float64),
+    }
+
+
+def _parse_option_csv(filename: str) -> dict[str, np.ndarray]:
+    time, symbol, bid, ask, last, iv, volume = [], [], [], [], [], [], []
+    symbol_ids: dict[str, int] = {}
+    with open(filename, 'r') as f:
+        for row in csv.DictReader(f):
+            time.append(int(row['timestamp']))
+            symbol.append(symbol_ids.setdefault(
+                row['contractSymbol'], len(symbol_ids)))
+            bid.append(float(row['bid']) if row['bid'] else 0.0)
+            ask.append(float(row['ask']) if row['ask'] else 0.0)
+            last.append(float(row['lastPrice']))
+            iv.append(float(row['impliedVolatility']))
+            volume.append(int(row['volume']) if row['volume'] else 0)
+    return {
+        "time": np.array(time, dtype=np.int64),
+        "symbol": np.array(symbol, dtype=np.int32),
+        "bid": np.array(bid, dtype=np.float64),
+        "ask": np.array(ask, dtype=np.float64),
+        "last": np.array(last, dtype=np.float64),
+        "iv": np.array(iv, dtype=np.float64),
+        "volume": np.array(volume, dtype=np.int64),
+        "symbols": np.array(list(symbol_ids), dtype=str),
+    }
+
+
+def load_stock_columns(filename: str) -> StockColumns:
+    """
+    Load a stock CSV as memory-mapped columns.
+    The CSV is parsed only once, later calls reuse the on-disk cache.
+    """
+    path = _cache_path(filename)
+    if not os.path.isdir(path):
+        _save(path, _parse_stock_csv(filename), filename)
+    return StockColumns(**_load(path, STOCK_FIELDS))
+
+
+def load_option_columns(filename: str) -> OptionColumns:
+    """
+    Load an option CSV as memory-mapped columns.
+    The CSV is parsed only once, later calls reuse the on-disk cache.
+    """
+    path = _cache_path(filename)
+    if not os.path.isdir(path):
+        _save(path, _parse_option_csv(filename), filename)
+    return OptionColumns(**_load(path, OPTION_FIELDS))
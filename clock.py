@@ -0,0 +1,84 @@
+from datetime import date, datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+# Engine times are int epoch seconds. Session days are int days since 1970-01-01
+# in TIMEZONE. Datetimes are only made for logging and plotting.
+
+TIMEZONE = ZoneInfo("America/Chicago")
+SECONDS_IN_HOUR = 60 * 60
+SECONDS_IN_DAY = 24 * SECONDS_IN_HOUR
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=None)
+def _hour_offset(hour: int) -> int:
+    # tz transitions happen on whole hours, so the utc offset is constant within an hour
+    offset = datetime.fromtimestamp(hour * SECONDS_IN_HOUR, tz=TIMEZONE).utcoffset()
+    assert offset is not None
+    return int(offset.total_seconds())
+
+
+def local_seconds(time: int) -> int:
+    """
+    Seconds since 1970-01-01 00:00 in TIMEZONE wall clock.
+    """
+    return time + _hour_offset(time // SECONDS_IN_HOUR)
+
+
+def session_day(time: int) -> int:
+    """
+    Session day id of a timestamp.
+    """
+    return local_seconds(time) // SECONDS_IN_DAY
+
+
+def session_days(times: np.ndarray) -> np.ndarray:
+    """
+    Vectorized session_day(), one tz lookup per distinct hour.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    hours, inverse = np.unique(times // SECONDS_IN_HOUR, return_inverse=True)
+    offsets = np.array([_hour_offset(hour) for hour in hours.tolist()], dtype=np.int64)
+    return (times + offsets[inverse]) // SECONDS_IN_DAY
+
+
+def hour(time: int) -> int:
+    """
+    Wall clock hour of a timestamp, 0-23.
+    """
+    return local_seconds(time) % SECONDS_IN_DAY // SECONDS_IN_HOUR
+
+
+def weekday(day: int) -> int:
+    """
+    Weekday of a session day, Monday is 0 like date.weekday().
+    """
+    # 1970-01-01 was a Thursday
+    return (day + 3) % 7
+
+
+def to_day(d: date) -> int:
+    return d.toordinal() - EPOCH_ORDINAL
+
+
+def to_date(day: int) -> date:
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+
+@lru_cache(maxsize=None)
+def at_time(day: int, hour: int, minute: int = 0) -> int:
+    """
+    Timestamp of a wall clock time on a session day.
+    """
+    d = to_date(day)
+    return int(datetime(d.year, d.month, d.day, hour, minute, tzinfo=TIMEZONE).timestamp())
+
+
+def to_datetime(time: int) -> datetime:
+    """
+    Datetime of a timestamp, for logging and plotting.
+    """
+    return datetime.fromtimestamp(time, tz=TIMEZONE)
@@ -1,8 +1,10 @@
-from dataclasses import dataclass
-from datetime import date, datetime, timedelta
+from dataclasses import dataclass, field
+from datetime import datetime
 from enum import Enum
-from typing import Union
-from zoneinfo import ZoneInfo
+from functools import lru_cache
+from typing import Tuple, Union
+
+from clock import at_time, session_day, to_date, to_day, weekday
 
 
 class InstrumentType(Enum):
@@ -10,16 +12,29 @@ class InstrumentType(Enum):
     STOCK = "STOCK"
 
 
-def to_expiration(date: date) -> datetime:
+def to_expiration(day: int) -> int:
     """
-    Create a datetime object for the given year, month, and day.
+    Expiration timestamp of options expiring on the given session day.
     If the given day falls on a weekend, the next Monday will be selected.
     Options stop trading at 4pm ET (3 CT), but can be exercised until 5:30pm ET (4:30 CT).
     """
-    if date.weekday() >= 5:
+    if weekday(day) >= 5:
         # If the date is Saturday or Sunday, move to next Monday
-        date = date + timedelta(days=(7 - date.weekday()))
-    return datetime(date.year, date.month, date.day, 16, 30, tzinfo=ZoneInfo("America/Chicago"))
+        day += 7 - weekday(day)
+    return at_time(day, 16, 30)
+
+
+@lru_cache(maxsize=None)
+def parse_symbol(symbol: str) -> Tuple[str, int, bool, float]:
+    """
+    Parse an OCC option symbol into (product, expiration timestamp, call, strike).
+    Results are cached, each symbol is only parsed once.
+    """
+    product = symbol[:-15]
+    expiration = to_expiration(to_day(datetime.strptime(symbol[-15:-9], '%y%m%d').date()))
+    call = symbol[-9] == 'C'
+    strike = int(symbol[-8:]) / 1000
+    return product, expiration, call, strike
 
 
 def round_strike(price: float, granularity: int) -> int:
@@ -35,30 +50,37 @@ def compute_strike(price: float, otm_pct: float, granularity: int) -> int:
     return round_strike(price * (1.0 + otm_pct), granularity=granularity)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Option:
     product: str
     call: bool
-    expiration: datetime
+    expiration: int  # epoch seconds
     strike: int
+    # OCC symbol, formatted once
+    symbol: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        """
+        OCC Option Symbology
+        """
+        object.__setattr__(
+            self, "symbol", f"{self.product}{to_date(session_day(self.expiration)).strftime('%y%m%d')}{'C' if self.call else 'P'}{int(self.strike * 1000):08d}")
 
     def __hash__(self):
         return hash((self.call, self.expiration, self.strike))
 
     def __str__(self):
-        """
-        OCC Option Symbology
-        """
-        return f"{self.product}{self.expiration.strftime('%y%m%d')}{'C' if self.call else 'P'}{int(self.strike * 1000):08d}"
+        return self.symbol
 
     def __repr__(self):
         return str(self)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Order:
     """
-    Option order: assume filled at market price.
+    Option order: filled at market price. `price` is a limit if > 0, filled
+    once the market price is at or better than it, a market order otherwise.
     Stock order: assume filled at limit price. `price` means limit.
     """
     id: int
@@ -68,6 +90,14 @@ class Order:
     price: float
     qty: int
     instrument: Union[Option, str]  # stock represented as str
+    # checked once at creation
+    is_option: bool = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        is_option = self.instrument_type == InstrumentType.OPTION
+        if is_option:
+            assert type(self.instrument) == Option, "Instrument must be Option"
+        object.__setattr__(self, "is_option", is_option)
 
     def __str__(self):
         return f"id={self.id} {'BUY' if self.buy else 'SELL'} {self.instrument} at ${self.price} x {self.qty}qty"
@@ -75,24 +105,15 @@ class Order:
     def __repr__(self):
         return str(self)
 
-    @property
-    def is_option(self) -> bool:
-        if self.instrument_type == InstrumentType.OPTION:
-            assert type(self.instrument) == Option, "Instrument must be Option"
-            return type(self.instrument) == Option
-        return False
-
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Trade:
     order: Order
     price: float
     qty: int
+    # the cash premium to be paid/received for this trade
+    premium: float = field(init=False, repr=False, compare=False)
 
-    @property
-    def premium(self) -> float:
-        """
-        The cash premium to be paid/received for this trade.
-        """
+    def __post_init__(self):
         contract_size = 100 if self.order.is_option else 1
-        return self.price * self.qty * contract_size
+        object.__setattr__(self, "premium", self.price * self.qty * contract_size)
@@ -0,0 +1,104 @@
+import argparse
+import time as timer
+from typing import Dict, Mapping, Tuple
+
+import numpy as np
+
+from cache import load_option_columns, load_stock_columns
+from clock import session_days
+from instrument import parse_symbol
+from price import INTEREST_RATE, SECONDS_IN_YEAR, implied_vols
+from tick import OptionData
+
+
+def quote_prices(bid: np.ndarray, ask: np.ndarray, last: np.ndarray) -> np.ndarray:
+    """
+    Price to invert: mid if the quote is two-sided, last trade otherwise.
+    """
+    two_sided = (bid > 0) & (ask > bid)
+    return np.where(two_sided, 0.5 * (bid + ask), last)
+
+
+def as_of_spots(times: np.ndarray, bar_times: np.ndarray, closes: np.ndarray
+                ) -> Tuple[np.ndarray, int]:
+    """
+    Last close at or before every time, as-of join against time-sorted bars.
+    Times before the first bar get NaN, and so do times whose bar is stale:
+    older than one bar interval and from an earlier session, e.g. bars ending
+    weeks before the quotes. Returns the spots and the number of stale times.
+    """
+    bar_index = np.searchsorted(bar_times, times, side='right') - 1
+    matched = np.asarray(bar_times)[np.maximum(bar_index, 0)]
+    # bar interval of the file, e.g. 1800 for 30min bars
+    interval = np.median(np.diff(bar_times)) if len(bar_times) > 1 else 0
+    stale = (bar_index >= 0) & (times - matched > interval) & \
+        (session_days(matched) != session_days(times))
+    found = (bar_index >= 0) & ~stale
+    spots = np.where(found, np.asarray(closes)[np.maximum(bar_index, 0)], np.nan)
+    return spots, int(np.count_nonzero(stale))
+
+
+def option_file_ivs(option_filename: str, stock_filename: str, r: float = INTEREST_RATE
+                    ) -> Tuple[np.ndarray, int]:
+    """
+    Implied vols for every row of an option file, in file order, and the number
+    of rows without a fresh stock price. The underlying price of each row is the
+    last stock close at or before its timestamp, see as_of_spots(). Rows before
+    the first stock bar or with a stale bar are NaN.
+    """
+    options = load_option_columns(option_filename)
+    stocks = load_stock_columns(stock_filename)
+
+    # contract terms, parsed once per symbol
+    terms = [parse_symbol(symbol) for symbol in options.symbols.tolist()]
+    expirations = np.array([expiration for _, expiration, _, _ in terms], dtype=np.int64)
+    strikes = np.array([strike for _, _, _, strike in terms])
+    calls = np.array([call for _, _, call, _ in terms])
+
+    # rows without a spot come out NaN
+    spots, stale = as_of_spots(np.asarray(options.time), np.asarray(stocks.time), stocks.close)
+
+    T = (expirations[options.symbol] - options.time) / SECONDS_IN_YEAR
+    prices = quote_prices(np.asarray(options.bid),
+                          np.asarray(options.ask), np.asarray(options.last))
+    vols = implied_vols(prices, spots, strikes[options.symbol], T, r, calls[options.symbol])
+    return vols, stale
+
+
+def chain_ivs(option_prices: Mapping[str, OptionData], spot: float, time: int,
+              r: float = INTEREST_RATE) -> Dict[str, float]:
+    """
+    Implied vols for an option chain snapshot, e.g. TickData.option_prices.
+    Contracts that cannot be solved map to NaN.
+    """
+    symbols = list(option_prices)
+    quotes = [option_prices[symbol] for symbol in symbols]
+    terms = [parse_symbol(symbol) for symbol in symbols]
+    T = np.array([expiration - time for _, expiration, _, _ in terms]) / SECONDS_IN_YEAR
+    prices = quote_prices(np.array([q.bid for q in quotes]),
+                          np.array([q.ask for q in quotes]),
+                          np.array([q.last for q in quotes]))
+    vols = implied_vols(prices, spot, np.array([strike for _, _, _, strike in terms]),
+                        T, r, np.array([call for _, _, call, _ in terms]))
+    return dict(zip(symbols, vols.tolist()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute implied vols of an option file and compare with Yahoo's.")
+    parser.add_argument("options")
+    parser.add_argument("stock")
+    parser.add_argument("--rate", type=float, default=INTEREST_RATE)
+    args = parser.parse_args()
+
+    start = timer.perf_counter()
+    vols, stale = option_file_ivs(args.options, args.stock, args.rate)
+    elapsed = timer.perf_counter() - start
+    yahoo = np.asarray(load_option_columns(args.options).iv)
+    solved = ~np.isnan(vols)
+    print(f"Solved {np.count_nonzero(solved)} / {len(vols)} rows in {elapsed:.3f}s")
+    if stale:
+        print(f"{stale} rows skipped, the stock bar before them is stale")
+    if np.any(solved):
+        diff = np.abs(vols[solved] - yahoo[solved])
+        print(f"|IV - Yahoo IV|: median {np.median(diff):.4f}, 90th pct {np.percentile(diff, 90):.4f}")
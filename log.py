@@ -1,34 +1,152 @@
+import json
+import sys
+from queue import Queue
+from threading import Thread
+from typing import List, Optional, TextIO
 
-from datetime import datetime
-from typing import Optional, TextIO
+from clock import to_datetime
+
+# log levels
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARN: "WARN", ERROR: "ERROR"}
+# text line prefix after the time, info lines have none
+LEVEL_TAGS = {DEBUG: "[DEBUG] ", INFO: "", WARN: "[WARN] ", ERROR: "[ERROR] "}
+
+BUFFER_SIZE = 1 << 20  # bytes of file buffer
+BATCH_LINES = 256  # lines per chunk handed to the background writer
+QUEUE_CHUNKS = 64  # chunks the background writer may lag behind
+
+
+class BackgroundWriter:
+    """
+    Writes chunks of log lines to a file on a daemon thread.
+    The queue is bounded, a producer outpacing the disk blocks instead of growing memory.
+    """
+
+    def __init__(self, file: TextIO, max_chunks: int = QUEUE_CHUNKS):
+        self.file = file
+        self.queue: Queue[Optional[str]] = Queue(max_chunks)
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                self.queue.task_done()
+                return
+            self.file.write(chunk)
+            self.queue.task_done()
+
+    def put(self, chunk: str):
+        self.queue.put(chunk)
+
+    def flush(self):
+        # wait until all queued chunks are written
+        self.queue.join()
+        self.file.flush()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
 
 
 class Logger:
+    """
+    Leveled logger. Messages use lazy %-style formatting, e.g.
+    logger.info("Order %s", order) only formats the order if INFO is enabled.
+    Writes to stdout until open() is called. Files are written through a large
+    buffer, optionally on a background thread, as text lines or JSON lines.
+    """
 
-    file: Optional[TextIO] = None
-    time: datetime = datetime.fromtimestamp(0)
+    def __init__(self, level: int = INFO):
+        self.level = level
+        self.file: Optional[TextIO] = None
+        self.jsonl = False
+        self.writer: Optional[BackgroundWriter] = None
+        # lines not yet handed to the background writer
+        self.lines: List[str] = []
+        self.time = 0
+        # formatted time, made on the first message after settime
+        self.stamp: Optional[str] = None
 
-    def info(self, message: str):
-        print(f"[{self.time}] {message}", file=self.file)
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
 
-    def warn(self, message: str):
-        print(f"[{self.time}] [WARN] {message}", file=self.file)
+    def log(self, level: int, message: str, *args):
+        if level < self.level:
+            return
+        if args:
+            message = message % args
+        if self.jsonl:
+            line = json.dumps(
+                {"time": self.time, "level": LEVEL_NAMES[level], "message": message}) + "\n"
+        else:
+            line = f"[{self.timestamp}] {LEVEL_TAGS[level]}{message}\n"
+        if self.writer:
+            self.lines.append(line)
+            if len(self.lines) >= BATCH_LINES:
+                self.writer.put("".join(self.lines))
+                self.lines = []
+        else:
+            (self.file or sys.stdout).write(line)
 
-    def error(self, message: str):
-        print(f"[{self.time}] [ERROR] {message}", file=self.file)
+    def debug(self, message: str, *args):
+        self.log(DEBUG, message, *args)
 
-    def settime(self, time: datetime):
-        self.time = time
+    def info(self, message: str, *args):
+        self.log(INFO, message, *args)
 
-    def open(self, path: str):
-        if self.file:
-            self.file.close()
-        self.file = open(path, "w")
+    def warn(self, message: str, *args):
+        self.log(WARN, message, *args)
+
+    def error(self, message: str, *args):
+        self.log(ERROR, message, *args)
+
+    @property
+    def timestamp(self) -> str:
+        if self.stamp is None:
+            self.stamp = str(to_datetime(self.time))
+        return self.stamp
+
+    def settime(self, time: int):
+        if time != self.time:
+            self.time = time
+            self.stamp = None
+
+    def open(self, path: str, background: bool = False, jsonl: Optional[bool] = None):
+        """
+        Log to a file, JSON lines if jsonl or the path ends with .jsonl.
+        With background, lines are written on a writer thread.
+        """
+        self.close()
+        self.file = open(path, "w", buffering=BUFFER_SIZE)
+        self.jsonl = path.endswith(".jsonl") if jsonl is None else jsonl
+        if background:
+            self.writer = BackgroundWriter(self.file)
+
+    def flush(self):
+        if self.writer:
+            if self.lines:
+                self.writer.put("".join(self.lines))
+                self.lines = []
+            self.writer.flush()
+        elif self.file:
+            self.file.flush()
 
     def close(self):
+        if self.writer:
+            self.flush()
+            self.writer.close()
+            self.writer = None
         if self.file:
             self.file.close()
             self.file = None
+        self.jsonl = False
 
 
 logger = Logger()
@@ -1,9 +1,8 @@
 from backtest import *
 from strategy import *
+from price import INTEREST_RATE
 from tick import MarketDataLoader
 
-INTEREST_RATE = 0.04
-
 if __name__ == "__main__":
     strategies = [
         SellCoveredCallStrategy("covered-call", "SPY", 50000,
@@ -16,16 +15,16 @@ if __name__ == "__main__":
                       dte=1, put_otm_pct=0.01, call_otm_pct=0.01),
         HoldStockStrategy("SPY spot", "SPY", 50000),
     ]
+    md = MarketDataLoader(
+        stock_filename='data/SPY-202507-15min.csv',
+        option_filename='data/SPY-options.csv',
+        align_to_bars=True
+    )
+    pricer = Pricer(INTEREST_RATE)
+    print(f"Backtesting {len(strategies)} strategies ...")
+    backtest_many(strategies, pricer, md, strategy_logs=True)
+    print(f"Backtest finished, {md.tick_count} ticks replayed")
     for strategy in strategies:
-        md = MarketDataLoader(
-            stock_filename='data/SPY-202507-15min.csv',
-            option_filename='data/SPY-options.csv'
-        )
-        pricer = Pricer(INTEREST_RATE)
-        print(f"Strategy ({strategy.name}) backtesting ...")
-        backtest(strategy, pricer, md)
-        print(
-            f"Strategy ({strategy.name}) finished, {md.tick_count} ticks replayed")
         # plot strategy PnL
         plot([
             ("Asset Value", strategy.asset_value_history),
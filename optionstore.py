@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+from datetime import date
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from cache import OPTION_FIELDS, OptionColumns, load_option_columns
+from clock import session_days, to_date, to_day
+
+MANIFEST = "manifest.json"
+# per-row columns, i.e. all but the symbol table
+ROW_FIELDS = [name for name in OPTION_FIELDS if name != "symbols"]
+DTYPES = {"time": np.int64, "symbol": np.int32, "bid": np.float64, "ask": np.float64,
+          "last": np.float64, "iv": np.float64, "volume": np.int64, "symbols": str}
+
+
+def store_path(symbol: str, data_dir: str = "data") -> str:
+    return os.path.join(data_dir, f"{symbol}-options")
+
+
+def _chunk_file(day: int, seq: int) -> str:
+    return f"{to_date(day):%Y%m%d}-{seq:06d}.npz"
+
+
+def _next_seq(manifest: Dict[str, dict], day: int) -> int:
+    prefix = f"{to_date(day):%Y%m%d}-"
+    return max((int(name[len(prefix):-len(".npz")]) + 1
+                for name in manifest if name.startswith(prefix)), default=0)
+
+
+def read_manifest(root: str) -> Dict[str, dict]:
+    """
+    Chunk file -> {"day", "start", "end", "rows"}, start and end are the first
+    and last quote times in the chunk. Files not in the manifest are ignored.
+    """
+    path = os.path.join(root, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_manifest(root: str, manifest: Dict[str, dict]):
+    tmp_path = os.path.join(root, f"{MANIFEST}.tmp-{os.getpid()}")
+    with open(tmp_path, "w") as f:
+        json.dump(dict(sorted(manifest.items())), f, indent=1)
+    os.replace(tmp_path, os.path.join(root, MANIFEST))
+
+
+def _read_chunk(path: str) -> Dict[str, np.ndarray]:
+    with np.load(path) as npz:
+        return {name: npz[name] for name in OPTION_FIELDS}
+
+
+def _write_chunk(path: str, columns: Dict[str, np.ndarray]):
+    # np.savez appends .npz to names without it
+    tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+    np.savez_compressed(tmp_path, **columns)
+    os.replace(tmp_path, path)
+
+
+def _concat(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """
+    Concatenate columns, re-interning the symbols the parts' rows use.
+    """
+    symbol_ids: Dict[str, int] = {}
+    symbol = []
+    for part in parts:
+        symbols = part["symbols"]
+        used = np.unique(part["symbol"])
+        remap = np.full(len(symbols), -1, dtype=np.int32)
+        remap[used] = [symbol_ids.setdefault(s, len(symbol_ids)) for s in symbols[used].tolist()]
+        symbol.append(remap[part["symbol"]])
+    columns = {name: np.concatenate([part[name] for part in parts]) for name in ROW_FIELDS}
+    columns["symbol"] = np.concatenate(symbol).astype(np.int32)
+    columns["symbols"] = np.array(list(symbol_ids), dtype=str)
+    return columns
+
+
+def _sort(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    # by time, keeping arrival order on ties
+    order = np.argsort(columns["time"], kind="stable")
+    for name in ROW_FIELDS:
+        columns[name] = columns[name][order]
+    return columns
+
+
+def _meta(day: int, columns: Dict[str, np.ndarray]) -> dict:
+    return {"day": str(to_date(day)), "start": int(columns["time"][0]),
+            "end": int(columns["time"][-1]), "rows": len(columns["time"])}
+
+
+def append(root: str, columns: Dict[str, np.ndarray]):
+    """
+    Append option quotes (OPTION_FIELDS columns) to a store as one new sorted,
+    compressed chunk per session day, so an append costs O(rows appended).
+    Chunks are written first and the manifest last, both by atomic rename, so a
+    crash leaves at most an unlisted chunk that readers ignore.
+    """
+    if len(columns["time"]) == 0:
+        return
+    os.makedirs(root, exist_ok=True)
+    manifest = read_manifest(root)
+    days = session_days(columns["time"])
+    for day in np.unique(days).tolist():
+        rows = days == day
+        chunk = {name: columns[name][rows] for name in ROW_FIELDS}
+        chunk["symbols"] = columns["symbols"]
+        chunk = _sort(_concat([chunk]))
+        name = _chunk_file(day, _next_seq(manifest, day))
+        _write_chunk(os.path.join(root, name), chunk)
+        manifest[name] = _meta(day, chunk)
+    _write_manifest(root, manifest)
+
+
+def compact(root: str):
+    """
+    Merge the chunks of every day with more than one into a single sorted chunk.
+    The merged chunk and manifest are written before the old chunks are deleted.
+    """
+    manifest = read_manifest(root)
+    by_day: Dict[str, List[str]] = {}
+    for name, meta in sorted(manifest.items()):
+        by_day.setdefault(meta["day"], []).append(name)
+    stale = []
+    for names in by_day.values():
+        if len(names) < 2:
+            continue
+        merged = _sort(_concat([_read_chunk(os.path.join(root, name)) for name in names]))
+        day = to_day(date.fromisoformat(manifest[names[0]]["day"]))
+        name = _chunk_file(day, _next_seq(manifest, day))
+        _write_chunk(os.path.join(root, name), merged)
+        for old in names:
+            del manifest[old]
+        manifest[name] = _meta(day, merged)
+        stale.extend(names)
+    _write_manifest(root, manifest)
+    for name in stale:
+        os.remove(os.path.join(root, name))
+
+
+def _empty() -> OptionColumns:
+    return OptionColumns(**{name: np.empty(0, dtype=DTYPES[name]) for name in OPTION_FIELDS})
+
+
+def load(root: str, start: Optional[int] = None, end: Optional[int] = None) -> OptionColumns:
+    """
+    Load the chunks with quotes within [start, end], time-sorted with arrival order
+    kept on ties. Only chunks overlapping the range are opened, rows outside it are dropped.
+    """
+    manifest = read_manifest(root)
+    parts = [
+        _read_chunk(os.path.join(root, name))
+        for name, meta in sorted(manifest.items())
+        if (start is None or meta["end"] >= start) and (end is None or meta["start"] <= end)
+    ]
+    if not parts:
+        return _empty()
+    columns = _concat(parts)
+    rows = np.ones(len(columns["time"]), dtype=bool)
+    if start is not None:
+        rows &= columns["time"] >= start
+    if end is not None:
+        rows &= columns["time"] <= end
+    for name in ROW_FIELDS:
+        columns[name] = columns[name][rows]
+    return OptionColumns(**_sort(columns))
+
+
+def chunks(root: str) -> Iterator[OptionColumns]:
+    """
+    The chunks of a store one at a time, in day and append order, e.g. to stream
+    a store without loading it whole. Each chunk is time-sorted.
+    """
+    for name in sorted(read_manifest(root)):
+        yield OptionColumns(**_read_chunk(os.path.join(root, name)))
+
+
+def merge(parts: List[OptionColumns]) -> OptionColumns:
+    """
+    Time-sorted union of option columns, e.g. of the files and stores of several
+    underlyings. Rows with the same time keep the order of the parts.
+    """
+    if not parts:
+        return _empty()
+    return OptionColumns(**_sort(_concat(
+        [{name: np.asarray(getattr(part, name)) for name in OPTION_FIELDS} for part in parts])))
+
+
+def import_csv(filename: str, root: str):
+    """
+    Append an option CSV, e.g. older scraper output, to a store.
+    """
+    columns = load_option_columns(filename)
+    append(root, {name: np.asarray(getattr(columns, name)) for name in OPTION_FIELDS})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import option CSVs into a date-partitioned option store.")
+    parser.add_argument("store", help="store directory, e.g. data/SPY-options")
+    parser.add_argument("csv", nargs="*")
+    parser.add_argument("--compact", action="store_true",
+                        help="merge each day's chunks into one")
+    args = parser.parse_args()
+
+    for filename in args.csv:
+        import_csv(filename, args.store)
+    if args.compact:
+        compact(args.store)
+    for name, meta in read_manifest(args.store).items():
+        print(name, meta)
@@ -0,0 +1,63 @@
+import math
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from instrument import Order
+
+
+class OrderBook:
+    """
+    Resting orders of one strategy, keyed by order id.
+    Stock limits are kept in (price, id) sorted ladders per side, so a bar only
+    touches the orders whose limit lies within its range. Option orders are
+    checked against the market every tick.
+    """
+
+    def __init__(self):
+        self.orders: Dict[int, Order] = {}
+        self.option_orders: Dict[int, Order] = {}
+        self.bids: List[Tuple[float, int]] = []
+        self.asks: List[Tuple[float, int]] = []
+
+    def add(self, order: Order):
+        assert order.id not in self.orders, f"Duplicate order id {order.id}"
+        self.orders[order.id] = order
+        if order.is_option:
+            self.option_orders[order.id] = order
+        else:
+            insort(self.bids if order.buy else self.asks, (order.price, order.id))
+
+    def cancel(self, order_id: int) -> Optional[Order]:
+        """
+        Remove an order, returns None if it is not resting (filled or unknown).
+        """
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        if order.is_option:
+            del self.option_orders[order_id]
+        else:
+            ladder = self.bids if order.buy else self.asks
+            del ladder[bisect_left(ladder, (order.price, order_id))]
+        return order
+
+    def get(self, order_id: int) -> Optional[Order]:
+        return self.orders.get(order_id)
+
+    def stock_orders_within(self, low: float, high: float) -> List[Order]:
+        """
+        Stock orders with low <= limit <= high, i.e. the ones a bar can fill.
+        O(log n + k) per side.
+        """
+        orders = []
+        for ladder in (self.bids, self.asks):
+            lo = bisect_left(ladder, (low,))
+            hi = bisect_right(ladder, (high, math.inf), lo=lo)
+            orders.extend(self.orders[order_id] for _, order_id in ladder[lo:hi])
+        return orders
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def __iter__(self) -> Iterator[Order]:
+        return iter(self.orders.values())
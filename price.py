@@ -1,29 +1,32 @@
 import math
-from typing import Dict, List, Tuple
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib import ticker as ticker
 
-from datetime import datetime, timedelta
-from typing import List
-
+from clock import SECONDS_IN_DAY, session_day, to_datetime
 from instrument import *
-from log import logger
-from tick import OptionData, TickData
+from log import DEBUG, Logger
+from surface import VolSurface
+from tick import OptionChain, TickData
 
-SECONDS_IN_DAY = 24 * 60 * 60
 SECONDS_IN_YEAR = 365 * SECONDS_IN_DAY
 TRADING_DAYS_IN_YEAR = 252
 MIN_TICKS_REQUIRED = 10
 DEFAULT_VOL = 0.10
+HISTORY_DAYS = 365
+INTEREST_RATE = 0.04
 
-type Line = Tuple[str, List[Tuple[datetime, float]]]
+type Line = Tuple[str, Iterable[Tuple[int, float]]]
 
 
 def plot(lines: List[Line], plot_path: str, tick: int, unit: str):
     plt.figure(figsize=(20, 10))
     for name, line in lines:
         times, values = zip(*line)
-        plt.plot(times, values, label=name)
+        plt.plot([to_datetime(time) for time in times], values, label=name)
     plt.xlabel("Date")
     plt.ylabel(f"Value ({unit})")
     plt.gca().yaxis.set_major_locator(ticker.MultipleLocator(tick * 5))
@@ -34,16 +37,154 @@ def plot(lines: List[Line], plot_path: str, tick: int, unit: str):
 
 
 def cdf(x: float) -> float:
-    # Abramowitz and Stegun formula 7.1.26
-    # Accurate to about 1e-4
-    sign = 1 if x >= 0 else -1
-    x = abs(x) / math.sqrt(2)
-    t = 1 / (1 + 0.3275911 * x)
-    a1, a2, a3, a4, a5 = 0.254829592, - \
-        0.284496736, 1.421413741, -1.453152027, 1.061405429
-    erf_approx = 1 - (((((a5 * t + a4) * t + a3) * t + a2)
-                       * t + a1) * t * math.exp(-x * x))
-    return 0.5 * (1 + sign * erf_approx)
+    # exact to double precision
+    return 0.5 * math.erfc(-x / math.sqrt(2))
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """
+    Vectorized standard normal CDF.
+    Hart (1968) rational approximation, absolute error around 1e-16.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    ax = np.abs(x)
+    exp = np.exp(-0.5 * ax * ax)
+    num = ((((((3.52624965998911e-02 * ax + 0.700383064443688) * ax + 6.37396220353165) * ax
+             + 33.912866078383) * ax + 112.079291497871) * ax + 221.213596169931) * ax
+           + 220.206867912376)
+    den = (((((((8.83883476483184e-02 * ax + 1.75566716318264) * ax + 16.064177579207) * ax
+              + 86.7807322029461) * ax + 296.564248779674) * ax + 637.333633378831) * ax
+            + 793.826512519948) * ax + 440.413735824752)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # continued fraction for the far tail
+        tail = exp / (ax + 1 / (ax + 2 / (ax + 3 / (ax + 4 / (ax + 0.65))))) / 2.506628274631
+    lower = np.where(ax < 7.07106781186547, exp * num / den, tail)
+    lower = np.where(ax > 37, 0.0, lower)
+    return np.where(x > 0, 1 - lower, lower)
+
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / math.sqrt(2 * math.pi)
+
+
+@dataclass
+class Greeks:
+    """
+    Black-Scholes theo and greeks, one entry per option.
+    """
+    theo: np.ndarray
+    delta: np.ndarray
+    gamma: np.ndarray
+    theta: np.ndarray  # per calendar day
+    vega: np.ndarray  # per 1% vol
+
+
+def black_scholes(S: float, K: np.ndarray, T: np.ndarray, r: float, sigma: np.ndarray,
+                  call: np.ndarray) -> Greeks:
+    """
+    Vectorized Black-Scholes theo and greeks.
+    Array inputs broadcast against each other, e.g. K[:, None] and T[None, :]
+    price a strike x expiry grid in one call.
+    Expired options (T <= 0) are worth their intrinsic value.
+    """
+    K, T, sigma, call = np.broadcast_arrays(
+        np.asarray(K, dtype=np.float64), np.asarray(T, dtype=np.float64),
+        np.asarray(sigma, dtype=np.float64), np.asarray(call, dtype=bool))
+    live = (T > 0) & (sigma > 0)
+    # dummy values for expired options, masked out below
+    T_live = np.where(live, T, 1.0)
+    sigma_live = np.where(live, sigma, 1.0)
+
+    sqrt_T = np.sqrt(T_live)
+    d1 = (np.log(S / K) + (r + 0.5 * sigma_live**2) * T_live) / (sigma_live * sqrt_T)
+    d2 = d1 - sigma_live * sqrt_T
+    discount = np.exp(-r * T_live)
+    pdf_d1 = norm_pdf(d1)
+    # N(d) for calls, N(-d) for puts
+    sign = np.where(call, 1.0, -1.0)
+    cdf_d1 = norm_cdf(sign * d1)
+    cdf_d2 = norm_cdf(sign * d2)
+
+    theo = sign * (S * cdf_d1 - K * discount * cdf_d2)
+    delta = sign * cdf_d1
+    gamma = pdf_d1 / (S * sigma_live * sqrt_T)
+    theta = (-S * pdf_d1 * sigma_live / (2 * sqrt_T)
+             - sign * r * K * discount * cdf_d2) / 365
+    vega = S * pdf_d1 * sqrt_T / 100
+
+    intrinsic = np.maximum(sign * (S - K), 0.0)
+    itm = intrinsic > 0
+    return Greeks(
+        theo=np.where(live, theo, intrinsic),
+        delta=np.where(live, delta, np.where(itm, sign, 0.0)),
+        gamma=np.where(live, gamma, 0.0),
+        theta=np.where(live, theta, 0.0),
+        vega=np.where(live, vega, 0.0),
+    )
+
+
+IV_MIN = 1e-4
+IV_MAX = 5.0
+IV_TOLERANCE = 1e-6
+IV_MAX_ITERATIONS = 100
+
+
+def implied_vols(prices: np.ndarray, S: np.ndarray, K: np.ndarray, T: np.ndarray, r: float,
+                 call: np.ndarray) -> np.ndarray:
+    """
+    Vectorized Black-Scholes implied vol inverter.
+    Newton steps on vega, falling back to bisection whenever a step leaves the
+    bracket, with all rows iterated at once. Rows priced outside the no-arbitrage
+    bounds, or already expired, get NaN.
+    """
+    prices, S, K, T, call = np.broadcast_arrays(
+        np.asarray(prices, dtype=np.float64), np.asarray(S, dtype=np.float64),
+        np.asarray(K, dtype=np.float64), np.asarray(T, dtype=np.float64),
+        np.asarray(call, dtype=bool))
+    sign = np.where(call, 1.0, -1.0)
+    T_live = np.where(T > 0, T, 1.0)
+    discount = np.exp(-r * T_live)
+    # no-arbitrage bounds
+    lower = np.maximum(sign * (S - K * discount), 0.0)
+    upper = np.where(call, S, K * discount)
+    solvable = (T > 0) & (prices > lower) & (prices < upper)
+
+    vols = np.full(prices.shape, np.nan)
+    idx = np.flatnonzero(solvable)
+    p, s, k, t, sg = (a.ravel()[idx] for a in (prices, S, K, T_live, sign))
+    sqrt_t = np.sqrt(t)
+    df = np.exp(-r * t)
+    lo = np.full(len(idx), IV_MIN)
+    hi = np.full(len(idx), IV_MAX)
+    # Manaster-Koehler starting point
+    sigma = np.clip(np.sqrt(2 * np.abs(np.log(s / k) + r * t) / t), 0.05, 1.0)
+    active = np.arange(len(idx))
+    for _ in range(IV_MAX_ITERATIONS):
+        if len(active) == 0:
+            break
+        a_s, a_k, a_t, a_sqrt_t, a_sg = s[active], k[active], t[active], sqrt_t[active], sg[active]
+        a_sigma = sigma[active]
+        d1 = (np.log(a_s / a_k) + (r + 0.5 * a_sigma**2) * a_t) / (a_sigma * a_sqrt_t)
+        d2 = d1 - a_sigma * a_sqrt_t
+        theo = a_sg * (a_s * norm_cdf(a_sg * d1) - a_k * df[active] * norm_cdf(a_sg * d2))
+        vega = a_s * norm_pdf(d1) * a_sqrt_t
+        diff = theo - p[active]
+        # theo is increasing in sigma, shrink the bracket
+        too_high = diff > 0
+        hi[active] = np.where(too_high, a_sigma, hi[active])
+        lo[active] = np.where(too_high, lo[active], a_sigma)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = a_sigma - diff / vega
+        in_bracket = (newton > lo[active]) & (newton < hi[active])
+        sigma[active] = np.where(
+            in_bracket, newton, 0.5 * (lo[active] + hi[active]))
+        done = (np.abs(diff) < IV_TOLERANCE) | (hi[active] - lo[active] < IV_TOLERANCE)
+        # keep the converged value, not the next step
+        sigma[active[done]] = a_sigma[done]
+        active = active[~done]
+
+    vols.ravel()[idx] = sigma
+    return vols
 
 
 def round_to_cent(x: float) -> float:
@@ -54,13 +195,13 @@ def round_to_cent(x: float) -> float:
     return max(cent_price, 0.01)
 
 
-def yte(option: Option, time: datetime) -> float:
+def yte(option: Option, time: int) -> float:
     """
     Calculate the years to expiration (Yte) for the given option.
     """
     if option.expiration < time:
         return 0.0
-    return (option.expiration - time).total_seconds() / SECONDS_IN_YEAR
+    return (option.expiration - time) / SECONDS_IN_YEAR
 
 
 def compute_realized_vol(ticks: List[TickData]) -> float:
@@ -86,7 +227,7 @@ def compute_realized_vol(ticks: List[TickData]) -> float:
 
     # Estimate average time delta between ticks
     time_deltas = [
-        (ticks[i].time - ticks[i - 1].time).total_seconds()
+        ticks[i].time - ticks[i - 1].time
         for i in range(1, len(ticks))
     ]
     avg_seconds = sum(time_deltas) / len(time_deltas)
@@ -94,66 +235,287 @@ def compute_realized_vol(ticks: List[TickData]) -> float:
     return std * math.sqrt(SECONDS_IN_YEAR / avg_seconds)
 
 
+class TickWindow:
+    """
+    Rolling window of stock closes, ordered by time.
+    Only times and closes are kept, not the ticks, so the option chains of past
+    ticks are freed. Appends and evictions are amortized O(1), lookups by time
+    are O(log n). Prefix sums of log returns make realized vol over any time range O(log n).
+    """
+
+    def __init__(self, max_age: int):
+        # in seconds
+        self.max_age = max_age
+        # evicted entries stay in the lists until compaction, live data starts at `start`
+        self.times: List[int] = []
+        self.closes: List[float] = []
+        self.start = 0
+        # prefix sums over log returns, entry i covers returns of ticks 1..i
+        self.return_counts: List[int] = []
+        self.return_sums: List[float] = []
+        self.return_sq_sums: List[float] = []
+
+    def append(self, time: int, close: float):
+        """
+        Append the latest close and evict entries older than max_age.
+        """
+        count, total, sq_total = 0, 0.0, 0.0
+        if self.times:
+            count = self.return_counts[-1]
+            total = self.return_sums[-1]
+            sq_total = self.return_sq_sums[-1]
+            p0 = self.closes[-1]
+            if p0 > 0 and close > 0:
+                log_return = math.log(close / p0)
+                count += 1
+                total += log_return
+                sq_total += log_return * log_return
+        self.times.append(time)
+        self.closes.append(close)
+        self.return_counts.append(count)
+        self.return_sums.append(total)
+        self.return_sq_sums.append(sq_total)
+        cutoff = time - self.max_age
+        while self.times[self.start] < cutoff:
+            self.start += 1
+        # compact once more than half of the buffer is evicted
+        if self.start > len(self.times) // 2:
+            del self.times[:self.start]
+            del self.closes[:self.start]
+            del self.return_counts[:self.start]
+            del self.return_sums[:self.start]
+            del self.return_sq_sums[:self.start]
+            self.start = 0
+
+    def index_at(self, time: int) -> int:
+        """
+        Window index of the first entry at or after the given time.
+        """
+        return bisect_left(self.times, time, lo=self.start) - self.start
+
+    def between(self, start: int, end: int) -> List[Tuple[int, float]]:
+        """
+        (time, close) entries with start <= time <= end.
+        """
+        lo = bisect_left(self.times, start, lo=self.start)
+        hi = bisect_right(self.times, end, lo=lo)
+        return list(zip(self.times[lo:hi], self.closes[lo:hi]))
+
+    def realized_vol(self, start: int, end: Optional[int] = None) -> float:
+        """
+        Realized volatility of ticks with start <= time <= end, same as
+        compute_realized_vol on those ticks.
+        Returns DEFAULT_VOL if not enough data.
+        """
+        lo = bisect_left(self.times, start, lo=self.start)
+        hi = len(self.times) if end is None else bisect_right(
+            self.times, end, lo=lo)
+        if hi - lo < MIN_TICKS_REQUIRED:
+            return DEFAULT_VOL
+
+        # returns of ticks lo+1..hi-1
+        count = self.return_counts[hi - 1] - self.return_counts[lo]
+        total = self.return_sums[hi - 1] - self.return_sums[lo]
+        sq_total = self.return_sq_sums[hi - 1] - self.return_sq_sums[lo]
+        if count < 2:
+            return DEFAULT_VOL
+        mean = total / count
+        variance = max(sq_total - total * mean, 0.0) / (count - 1)
+        std = math.sqrt(variance)
+
+        # average time delta between ticks
+        avg_seconds = (self.times[hi - 1] - self.times[lo]) / (hi - lo - 1)
+        if avg_seconds <= 0:
+            return DEFAULT_VOL
+
+        return std * math.sqrt(SECONDS_IN_YEAR / avg_seconds)
+
+    def __len__(self) -> int:
+        return len(self.times) - self.start
+
+    def __getitem__(self, index: int) -> Tuple[int, float]:
+        """
+        (time, close) of an entry.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TickWindow index out of range")
+        return self.times[self.start + index], self.closes[self.start + index]
+
+    def __iter__(self) -> Iterator[Tuple[int, float]]:
+        for i in range(self.start, len(self.times)):
+            yield self.times[i], self.closes[i]
+
+
 class Pricer:
     """
     Theo calculator based on BSM and historical volatility.
     """
 
-    time: datetime
+    time: int
     val: float
-    tick_history: List[TickData] = []
 
     # EVENT HANDLERS
 
-    def __init__(self, r: float):
+    def __init__(self, r: float, fit_surface: bool = True,
+                 vol_indexes: Optional[Dict[str, str]] = None):
         """
         Initialize the pricer with a fixed risk-free rate.
+        With fit_surface, options covered by the market IV surface are priced
+        off the surface instead of realized vol.
+        vol_indexes maps products to a replayed vol index quoted in vol points,
+        e.g. {"SPY": "VIX"}, used as the base vol instead of realized vol.
         """
         self.r = r
-
-    def val_event(self, time: datetime, price: float):
+        self.vol_indexes: Dict[str, str] = vol_indexes or {}
+        # closes only, the current tick is last_tick
+        self.tick_history = TickWindow(HISTORY_DAYS * SECONDS_IN_DAY)
+        self.last_tick: Optional[TickData] = None
+        self.surface: Optional[VolSurface] = VolSurface() if fit_surface else None
+        # latest option quotes, used to fill option orders
+        self.option_prices = OptionChain()
+        # current tick, for prices of other underlyings
+        self.market: Optional[TickData] = None
+        # logs to stdout until a backtest attaches its logger
+        self.logger = Logger()
+        # per-tick caches, shared by every strategy priced on the same tick
+        self.realized_vols: Dict[int, float] = {}
+        self.theos: Dict[Option, float] = {}
+
+    def val_event(self, time: int, price: float, tick: Optional[TickData] = None):
         """
         Handler for latest val update.
+        Option quotes and prices of other underlyings are taken from the current tick.
         """
         self.time = time
         self.val = price
+        if tick is not None:
+            self.market = tick
+            self.option_prices = tick.option_prices
+        self.realized_vols.clear()
+        self.theos.clear()
 
     def tick_event(self, tick: TickData):
         """
         Handler for full tick data update.
         """
-        self.tick_history.append(tick)
-        # clean up data older than 1 year
-        # TODO: improve performance here by using a fifo queue
-        cutoff = self.time - timedelta(days=365)
-        self.tick_history = [t for t in self.tick_history if t.time >= cutoff]
+        # also cleans up data older than 1 year
+        self.tick_history.append(tick.time, tick.stock_price.close)
+        self.last_tick = tick
+        if self.surface:
+            # refits lazily, only if the option chain changed
+            self.surface.update(tick.option_prices,
+                                tick.option_version, self.val, self.time, tick.spots())
+        self.realized_vols.clear()
+        self.theos.clear()
 
     # NUMERIC METHODS
 
-    def estimate_vol(self, option: Option, yte: float) -> float:
+    def spot(self, product: str) -> float:
         """
-        Determine the vol for pricing.
+        Latest price of an underlying, the val unless it is another replayed underlying.
         """
+        if self.market and product in self.market.symbol_index:
+            price = self.market.price(product)
+            if not math.isnan(price):
+                return price
+        return self.val
 
-        lookback_period_days = max(7, int(yte * 365))
-        # find ticks that are within the lookback period
-        ticks = [
-            t for t in self.tick_history if t.time >= self.time - timedelta(days=lookback_period_days)]
-
-        vol = compute_realized_vol(ticks)
+    def index_vol(self, product: str) -> Optional[float]:
+        """
+        Vol implied by the product's vol index, or None if it has none or no quote yet.
+        """
+        index = self.vol_indexes.get(product)
+        if index and self.market and index in self.market.symbol_index:
+            level = self.market.price(index)
+            if not math.isnan(level):
+                return level / 100.0
+        return None
 
-        # Vol skew adjustment
-        # TODO: improve IV model, especially how d(IV)/d(OTM) changes with OTM
-        # we should fit market IV
+    def estimate_vol(self, option: Option, yte: float) -> float:
+        """
+        Determine the vol for pricing.
+        Market IV from the surface if available, otherwise realized vol with a skew heuristic.
+        """
+        if self.surface:
+            market_vol = self.surface.vol(
+                option.product, option.expiration, option.strike)
+            if market_vol is not None:
+                return market_vol
+
+        vol = self.index_vol(option.product)
+        if vol is None:
+            lookback_period_days = max(7, int(yte * 365))
+            if lookback_period_days not in self.realized_vols:
+                # realized vol of ticks within the lookback period
+                self.realized_vols[lookback_period_days] = self.tick_history.realized_vol(
+                    self.time - lookback_period_days * SECONDS_IN_DAY)
+            vol = self.realized_vols[lookback_period_days]
+
+        # Vol skew adjustment, for options not covered by market IV
+        spot = self.spot(option.product)
         otm_factor = 1 + 3.0/(yte * 365)  # vol += otm_factor per 1% OTM
-        otm_pct = math.fabs(option.strike - self.val) / self.val
+        otm_pct = math.fabs(option.strike - spot) / spot
         vol += otm_pct * otm_factor
         return vol
 
+    def estimate_vols(self, strikes: np.ndarray, T: np.ndarray, product: str = "") -> np.ndarray:
+        """
+        Vectorized realized vol model of estimate_vol, over arrays of strikes
+        and years to expiration. Does not consult the surface.
+        """
+        strikes, T = np.broadcast_arrays(
+            np.asarray(strikes, dtype=np.float64), np.asarray(T, dtype=np.float64))
+        index_vol = self.index_vol(product)
+        if index_vol is not None:
+            vols = np.full(T.shape, index_vol)
+        else:
+            lookback_days = np.maximum(7, (T * 365).astype(np.int64))
+            vols = np.empty(T.shape)
+            for days in np.unique(lookback_days).tolist():
+                if days not in self.realized_vols:
+                    self.realized_vols[days] = self.tick_history.realized_vol(
+                        self.time - days * SECONDS_IN_DAY)
+                vols[lookback_days == days] = self.realized_vols[days]
+
+        # Vol skew adjustment, same as estimate_vol
+        spot = self.spot(product)
+        with np.errstate(divide='ignore'):
+            otm_factor = 1 + 3.0 / (T * 365)
+        otm_pct = np.abs(strikes - spot) / spot
+        return vols + otm_pct * otm_factor
+
+    def calculate_greeks(self, product: str, strikes: np.ndarray, expirations: Sequence[int],
+                         calls: np.ndarray) -> Greeks:
+        """
+        Price a batch of options in one vectorized call, e.g. a whole chain.
+        Inputs broadcast, so strikes[:, None] with expirations[None, :] gives a
+        strike x expiry grid. Theos are rounded to cents like calculate_theo.
+        """
+        strikes, expirations = np.broadcast_arrays(
+            np.asarray(strikes, dtype=np.float64), np.asarray(expirations, dtype=np.int64))
+        T = np.maximum(expirations - self.time, 0) / SECONDS_IN_YEAR
+        vols = self.estimate_vols(strikes, T, product)
+        if self.surface:
+            # market IV where the surface covers the expiry
+            for expiration in np.unique(expirations).tolist():
+                mask = expirations == expiration
+                market_vols = self.surface.vols(
+                    product, expiration, strikes[mask])
+                if market_vols is not None:
+                    vols[mask] = market_vols
+        greeks = black_scholes(self.spot(product), strikes, T, self.r, vols, calls)
+        greeks.theo = np.maximum(np.round(greeks.theo * 100.0) / 100.0, 0.01)
+        return greeks
+
     def calculate_theo(self, option: Option) -> float:
         """
         Calculate the option theo price using a simple Black-Scholes model.
+        Theos are cached until the next val or tick event.
         """
+        if option in self.theos:
+            return self.theos[option]
 
         # estimate vol skew
         T = yte(option, self.time)
@@ -161,7 +523,7 @@ class Pricer:
 
         # Black-Scholes
         K = option.strike
-        S = self.val
+        S = self.spot(option.product)
         sigma = skewed_vol
 
         d1 = (math.log(S / K) + (self.r + 0.5 * sigma**2) * T) / \
@@ -174,34 +536,31 @@ class Pricer:
             price = K * math.exp(-self.r * T) * cdf(-d2) - S * cdf(-d1)
 
         theo = round_to_cent(price)
+        self.theos[option] = theo
 
         return theo
 
-    def market_price_or_theo(self, option: Option) -> float:
+    def market_price_or_theo(self, option: Option, logger: Optional[Logger] = None) -> float:
         """
         Find the latest market price for an option, or calculate_theo if not available.
+        Logs to the given logger, e.g. the one of the strategy asking, or the pricer's own.
         """
-        if str(option) in self.option_prices:
-            price = self.option_prices[str(option)]
-            logger.info(
-                f"Market price for {option} is {price.last} ({price.iv * 100}% IV), last trade at {price.time}")
+        log = logger or self.logger
+        price = self.option_prices.quote(option)
+        if price:
+            log.info("Market price for %s is %s (%s%% IV), last trade at %s",
+                     option, price.last, price.iv * 100, to_datetime(price.time))
             return price.last
         else:
             theo = self.calculate_theo(option)
-            logger.warn(f"Market price for {option} not found, theo is {theo}")
-            logger.warn(str(self.last_tick))
+            log.warn("Market price for %s not found, theo is %s", option, theo)
+            if log.enabled(DEBUG) and self.last_tick:
+                # formats the whole option chain
+                log.debug("%s", self.last_tick)
             return theo
 
     # HELPERS
 
-    @property
-    def last_tick(self) -> TickData:
-        return self.tick_history[-1]
-
-    @property
-    def option_prices(self) -> Dict[str, OptionData]:
-        return self.last_tick.option_prices
-
     def plot_vols(self, plot_path: str):
         """
         Plot 7d, 14d, and 30d historical volatility.
@@ -214,14 +573,10 @@ class Pricer:
 
         for window in windows:
             vol_percents = []
-            for i in range(len(self.tick_history)):
-                window_start = self.tick_history[i].time - \
-                    timedelta(days=window)
-                window_ticks = [
-                    t for t in self.tick_history if window_start <= t.time <= self.tick_history[i].time
-                ]
-                vol = compute_realized_vol(window_ticks)
-                vol_percents.append((self.tick_history[i].time, vol * 100))
+            for time, _ in self.tick_history:
+                vol = self.tick_history.realized_vol(
+                    time - window * SECONDS_IN_DAY, time)
+                vol_percents.append((time, vol * 100))
 
             lines.append((f"{window}d Vol", vol_percents))
 
@@ -243,7 +598,7 @@ class Pricer:
             price_and_vols = []
             strike = round(self.val * (1 + otm_pct))
             for dte in [0, 1, 7, 30]:
-                expiration = to_expiration(self.time + timedelta(days=dte))
+                expiration = to_expiration(session_day(self.time) + dte)
                 option = Option("SPY", True, expiration, strike)
                 T = yte(option, self.time)
                 vol = self.estimate_vol(option, T)
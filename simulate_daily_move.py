@@ -1,7 +1,143 @@
+import argparse
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
 import matplotlib.ticker as ticker
 import numpy as np
 import matplotlib.pyplot as plt
 
+TRADING_DAYS = 252
+CHUNK_ELEMENTS = 1 << 22  # paths x days drawn at once, 16MB of float32 normals
+
+
+@dataclass
+class TerminalStats:
+    """
+    Streaming statistics of simulated terminal prices.
+    """
+    count: int = 0
+    mean: float = 0.0
+    std: float = 0.0
+    min: float = np.inf
+    max: float = -np.inf
+    # std of log(terminal / start)
+    log_std: float = 0.0
+    # level -> probability of ending below it
+    prob_below: Dict[float, float] = field(default_factory=dict)
+
+
+def _check_sizes(num_days: int, num_paths: int, chunk_elements: int):
+    if num_days <= 0:
+        raise ValueError(f"num_days must be positive, got {num_days}")
+    if num_paths <= 0:
+        raise ValueError(f"num_paths must be positive, got {num_paths}")
+    if chunk_elements <= 0:
+        raise ValueError(f"chunk_elements must be positive, got {chunk_elements}")
+
+
+def _log_return_chunks(vol: float, num_days: int, num_paths: int, leverage: float,
+                       rng: np.random.Generator, dtype: type, antithetic: bool,
+                       chunk_elements: int) -> Iterator[np.ndarray]:
+    """
+    Daily log returns of the leveraged product, (paths, days) chunks of at most
+    chunk_elements. With antithetic, every chunk's second half mirrors its first.
+    """
+    daily_vol = leverage * vol / np.sqrt(TRADING_DAYS)
+    rows = max(2, chunk_elements // num_days) // 2 * 2
+    for start in range(0, num_paths, rows):
+        n = min(rows, num_paths - start)
+        if antithetic:
+            z = rng.standard_normal(((n + 1) // 2, num_days), dtype=dtype)
+            z = np.concatenate([z, -z])[:n]
+        else:
+            z = rng.standard_normal((n, num_days), dtype=dtype)
+        z *= dtype(daily_vol)
+        yield z
+
+
+def simulate_paths(start_price: float, vol: float, num_days: int, num_paths: int,
+                   leverage: float = 3.0, seed: Optional[int] = None, dtype: type = np.float64,
+                   antithetic: bool = False, chunk_elements: int = CHUNK_ELEMENTS) -> np.ndarray:
+    """
+    Simulated prices of a daily rebalanced leveraged product, (paths, days).
+    The underlying's daily log returns are normal with annualized volatility vol,
+    the product's are leverage times that. Materializes all paths, use
+    simulate_terminal() or terminal_stats() when only the end prices matter.
+    """
+    _check_sizes(num_days, num_paths, chunk_elements)
+    rng = np.random.default_rng(seed)
+    paths = np.empty((num_paths, num_days), dtype=dtype)
+    row = 0
+    for returns in _log_return_chunks(vol, num_days, num_paths, leverage, rng, dtype,
+                                      antithetic, chunk_elements):
+        np.cumsum(returns, axis=1, out=returns)
+        paths[row:row + len(returns)] = start_price * np.exp(returns)
+        row += len(returns)
+    return paths
+
+
+def simulate_terminal(start_price: float, vol: float, num_days: int, num_paths: int,
+                      leverage: float = 3.0, seed: Optional[int] = None, dtype: type = np.float64,
+                      antithetic: bool = False, chunk_elements: int = CHUNK_ELEMENTS) -> np.ndarray:
+    """
+    Terminal prices of simulate_paths(), same seed same prices, without keeping the paths.
+    Memory is O(paths + chunk_elements).
+    """
+    _check_sizes(num_days, num_paths, chunk_elements)
+    rng = np.random.default_rng(seed)
+    prices = np.empty(num_paths, dtype=dtype)
+    row = 0
+    for returns in _log_return_chunks(vol, num_days, num_paths, leverage, rng, dtype,
+                                      antithetic, chunk_elements):
+        prices[row:row + len(returns)] = start_price * np.exp(returns.sum(axis=1))
+        row += len(returns)
+    return prices
+
+
+def _merge_moments(count: int, mean: float, m2: float, values: np.ndarray) -> Tuple[float, float]:
+    """
+    Mean and sum of squared deviations of count samples merged with values (Chan et al.).
+    """
+    n = len(values)
+    total = count + n
+    values_mean = float(values.mean())
+    delta = values_mean - mean
+    m2 += float(((values - values_mean) ** 2).sum()) + delta ** 2 * count * n / total
+    return mean + delta * n / total, m2
+
+
+def terminal_stats(start_price: float, vol: float, num_days: int, num_paths: int,
+                   leverage: float = 3.0, seed: Optional[int] = None, dtype: type = np.float64,
+                   antithetic: bool = False, levels: Sequence[float] = (),
+                   chunk_elements: int = CHUNK_ELEMENTS) -> TerminalStats:
+    """
+    Statistics of the terminal prices of simulate_paths(), accumulated chunk by
+    chunk, so memory is O(chunk_elements) whatever the number of paths.
+    """
+    _check_sizes(num_days, num_paths, chunk_elements)
+    rng = np.random.default_rng(seed)
+    stats = TerminalStats()
+    # log return mean and sums of squared deviations, merged chunk by chunk
+    m2 = log_mean = log_m2 = 0.0
+    below = np.zeros(len(levels), dtype=np.int64)
+    for returns in _log_return_chunks(vol, num_days, num_paths, leverage, rng, dtype,
+                                      antithetic, chunk_elements):
+        log_returns = returns.sum(axis=1, dtype=np.float64)
+        prices = start_price * np.exp(log_returns)
+        stats.mean, m2 = _merge_moments(stats.count, stats.mean, m2, prices)
+        log_mean, log_m2 = _merge_moments(stats.count, log_mean, log_m2, log_returns)
+        stats.count += len(prices)
+        stats.min = min(stats.min, float(prices.min()))
+        stats.max = max(stats.max, float(prices.max()))
+        below += (prices[:, None] < np.asarray(levels)).sum(axis=0)
+    if stats.count:
+        stats.std = float(np.sqrt(m2 / stats.count))
+        stats.log_std = float(np.sqrt(log_m2 / stats.count))
+        stats.prob_below = {level: int(count) / stats.count
+                            for level, count in zip(levels, below.tolist())}
+    return stats
+
 
 def simulate_tqqq_price(start_price, nasdaq_vol, num_days, num_simulations):
     """
@@ -16,68 +152,84 @@ def simulate_tqqq_price(start_price, nasdaq_vol, num_days, num_simulations):
     Returns:
         np.ndarray: Final simulated TQQQ prices
     """
+    # TQQQ return is 3x Nasdaq daily return
+    return simulate_terminal(start_price, nasdaq_vol, num_days, num_simulations, leverage=3.0)
+
+
+def positive_int(value: str) -> int:
+    """
+    argparse type for counts, e.g. --days and --paths.
+    """
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+
+def plot_cdf(prices: np.ndarray, start_price: float, days_forward: int, path: str):
+    plt.figure(figsize=(10, 6))
+    plt.hist(
+        prices,
+        bins=100,
+        cumulative=True,
+        density=True,
+        color='skyblue',
+        edgecolor='black',
+        label='CDF'
+    )
+    plt.axvline(start_price, color='red', linestyle='--', label='Start Price')
+    plt.title(
+        f"Cumulative Distribution of TQQQ Prices in {days_forward} Days\n({len(prices)} Simulations)")
+    plt.xlabel("TQQQ Price")
+    plt.ylabel("Cumulative Probability")
+    # Add minor ticks
+    plt.gca().xaxis.set_major_locator(ticker.MultipleLocator(5))
+    plt.gca().xaxis.set_minor_locator(ticker.MultipleLocator(1))
+    plt.gca().yaxis.set_major_locator(ticker.MultipleLocator(0.1))
+    plt.grid(True, which='both', linestyle='--', linewidth=0.5)
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.show()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Monte Carlo prices of a 3x leveraged ETF, e.g. TQQQ.")
+    parser.add_argument("--price", type=float, default=75.6, help="current price")
+    parser.add_argument("--vol", type=float, default=0.18,
+                        help="annualized volatility of the underlying index")
+    parser.add_argument("--days", type=positive_int, default=15, help="days to simulate forward")
+    parser.add_argument("--paths", type=positive_int, default=10000)
+    parser.add_argument("--leverage", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--float32", action="store_true")
+    parser.add_argument("--antithetic", action="store_true")
+    parser.add_argument("--levels", type=float, nargs="*", default=[],
+                        help="report the probability of ending below these prices")
+    parser.add_argument("--stats-only", action="store_true",
+                        help="skip the plot, for large numbers of paths")
+    args = parser.parse_args()
+    dtype = np.float32 if args.float32 else np.float64
+
+    start = perf_counter()
+    if args.stats_only:
+        stats = terminal_stats(args.price, args.vol, args.days, args.paths, args.leverage,
+                               args.seed, dtype, args.antithetic, args.levels)
+        log_std = stats.log_std
+        print(f"{stats.count} paths in {perf_counter() - start:.2f}s: mean {stats.mean:.2f}, "
+              f"std {stats.std:.2f}, min {stats.min:.2f}, max {stats.max:.2f}")
+        for level, prob in stats.prob_below.items():
+            print(f"P(price < {level:g}) = {prob:.4%}")
+    else:
+        simulated_prices = simulate_terminal(args.price, args.vol, args.days, args.paths,
+                                             args.leverage, args.seed, dtype, args.antithetic)
+        print(f"{args.paths} paths in {perf_counter() - start:.2f}s")
+        for level in args.levels:
+            print(f"P(price < {level:g}) = {np.mean(simulated_prices < level):.4%}")
+        log_std = float(np.std(np.log(simulated_prices / args.price)))
+        plot_cdf(simulated_prices, args.price, args.days, "tmp/simulated_tqqq_prices.png")
 
-    # Convert annual volatility to daily
-    daily_vol = nasdaq_vol / np.sqrt(252)
-
-    # Preallocate simulation matrix
-    tqqq_prices = np.full((num_simulations,), start_price, dtype=np.float64)
-
-    for day in range(num_days):
-        # Simulate daily Nasdaq return
-        nasdaq_daily_return = np.random.normal(
-            0, daily_vol, size=num_simulations)
-        # TQQQ return is 3x Nasdaq daily return
-        tqqq_daily_return = 3 * nasdaq_daily_return
-        # Update TQQQ price
-        tqqq_prices *= np.exp(tqqq_daily_return)
-
-    return tqqq_prices
-
-
-# Parameters
-current_price = 75.6
-volatility = 0.18  # annualized volatility
-days_forward = 15
-num_simulations = 10000
-
-# Run simulation
-simulated_prices = simulate_tqqq_price(
-    start_price=current_price,
-    nasdaq_vol=volatility,
-    num_days=days_forward,
-    num_simulations=num_simulations
-)
-
-
-# Plot cumulative distribution
-plt.figure(figsize=(10, 6))
-counts, bins, patches = plt.hist(
-    simulated_prices,
-    bins=100,
-    cumulative=True,
-    density=True,
-    color='skyblue',
-    edgecolor='black',
-    label='CDF'
-)
-plt.axvline(current_price, color='red', linestyle='--', label='Start Price')
-plt.title(
-    f"Cumulative Distribution of TQQQ Prices in {days_forward} Days\n({num_simulations} Simulations)")
-plt.xlabel("TQQQ Price")
-plt.ylabel("Cumulative Probability")
-# Add minor ticks
-plt.gca().xaxis.set_major_locator(ticker.MultipleLocator(5))
-plt.gca().xaxis.set_minor_locator(ticker.MultipleLocator(1))
-plt.gca().yaxis.set_major_locator(ticker.MultipleLocator(0.1))
-plt.grid(True, which='both', linestyle='--', linewidth=0.5)
-plt.legend()
-plt.tight_layout()
-plt.show()
-plt.savefig("simulated_tqqq_prices.png")
-
-# Compute TQQQ volatility
-log_returns = np.log(simulated_prices / current_price)
-realized_std = np.std(log_returns)
-annualized_vol = realized_std * np.sqrt(252 / days_forward)
-print(f"Estimated Annualized Volatility of TQQQ: {annualized_vol:.2%}")
+    # Compute TQQQ volatility
+    annualized_vol = log_std * np.sqrt(TRADING_DAYS / args.days)
+    print(f"Estimated Annualized Volatility of TQQQ: {annualized_vol:.2%}")
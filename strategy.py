@@ -1,6 +1,6 @@
 import math
-from datetime import datetime
 
+from clock import hour
 from instrument import *
 from strategy_base import OptionStrategy
 
@@ -13,16 +13,18 @@ class WheelStrategy(OptionStrategy):
         self.call_otm_pct = call_otm_pct
         self.dte = dte
 
-    def tick_logic(self, time: datetime, price: float):
-        if time.hour >= 10 and not self.trades_option_open:
+    def tick_logic(self, time: int, price: float):
+        if hour(time) >= 10 and not self.trades_option_open:
             if self.holding_stock:
                 # sell call
-                strike = compute_strike(price, self.call_otm_pct, 5)
+                strike = self.listed_strike(
+                    True, self.dte, compute_strike(price, self.call_otm_pct, 5))
                 self.send_order_option(
                     buy=False, call=True, dte=self.dte, strike=strike, qty=1)
             else:
                 # sell put
-                strike = compute_strike(price, -self.put_otm_pct, 5)
+                strike = self.listed_strike(
+                    False, self.dte, compute_strike(price, -self.put_otm_pct, 5))
                 self.send_order_option(
                     buy=False, call=False, dte=self.dte, strike=strike, qty=1)
 
@@ -34,11 +36,12 @@ class SellCoveredCallStrategy(OptionStrategy):
         self.call_otm_pct = call_otm_pct
         self.dte = dte
 
-    def tick_logic(self, time: datetime, price: float):
-        if time.hour >= 10 and not self.trades_option_open:
+    def tick_logic(self, time: int, price: float):
+        if hour(time) >= 10 and not self.trades_option_open:
             if self.holding_stock:
                 # sell call
-                strike = compute_strike(price, self.call_otm_pct, 5)
+                strike = self.listed_strike(
+                    True, self.dte, compute_strike(price, self.call_otm_pct, 5))
                 self.send_order_option(
                     buy=False, call=True, dte=self.dte, strike=strike, qty=1)
             else:
@@ -55,7 +58,7 @@ class SellPutStrategy(OptionStrategy):
         self.put_otm_pct = put_otm_pct
         self.dte = dte
 
-    def tick_logic(self, time: datetime, price: float):
+    def tick_logic(self, time: int, price: float):
         if self.holding_stock:
             # exit the stock position asap
             qty = self.positions[self.product]
@@ -64,15 +67,33 @@ class SellPutStrategy(OptionStrategy):
                 buy=False, price=price, qty=qty)
         else:
             # sell put daily
-            if time.hour >= 10 and not self.trades_option_open:
-                strike = compute_strike(price, -self.put_otm_pct, 5)
+            if hour(time) >= 10 and not self.trades_option_open:
+                strike = self.listed_strike(
+                    False, self.dte, compute_strike(price, -self.put_otm_pct, 5))
                 self.send_order_option(
                     buy=False, call=False, dte=self.dte, strike=strike, qty=1)
 
 
+class VixGatedSellPutStrategy(SellPutStrategy):
+    """
+    SellPutStrategy that only opens new puts while the vol index is at or below max_vix.
+    Needs the vol index replayed as an underlying, no puts are sold before its first bar.
+    """
+
+    def __init__(self, *args, max_vix: float, vix_symbol: str = "VIX", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_vix = max_vix
+        self.vix_symbol = vix_symbol
+
+    def tick_logic(self, time: int, price: float):
+        # NaN compares false, so a missing quote also blocks selling
+        if self.holding_stock or self.price_of(self.vix_symbol) <= self.max_vix:
+            super().tick_logic(time, price)
+
+
 class HoldStockStrategy(OptionStrategy):
 
-    def tick_logic(self, time: datetime, price: float):
+    def tick_logic(self, time: int, price: float):
         if not self.holding_stock:
             max_qty = math.floor(self.cash / price)
             self.send_order_stock(
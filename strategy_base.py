@@ -1,35 +1,119 @@
-from typing import Dict, List, Tuple, Union
-from datetime import datetime, timedelta
+import math
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import replace
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
+from clock import session_day
 from instrument import *
-from log import logger
+from log import Logger
+from orderbook import OrderBook
 from price import round_to_cent
+from tick import OptionChain, TickData
+
+
+class ValueHistory:
+    """
+    Append-only (time, value) series backed by two typed arrays, 16 bytes per point.
+    Indexes and iterates as (time, value) pairs, like a list of tuples.
+    """
+
+    __slots__ = ("times", "values")
+
+    def __init__(self):
+        self.times = array('q')
+        self.values = array('d')
+
+    def append(self, time: int, value: float):
+        self.times.append(time)
+        self.values.append(value)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def __getitem__(self, index: int) -> Tuple[int, float]:
+        return self.times[index], self.values[index]
+
+    def __iter__(self) -> Iterator[Tuple[int, float]]:
+        return zip(self.times, self.values)
+
+
+class OpenOptionTrades:
+    """
+    Open option trades bucketed by expiration session day, each bucket in fill order.
+    Adds and removals are O(1) plus O(log days) when a bucket is created or emptied,
+    so EOD settlement only touches the trades that expire.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[int, Dict[int, Trade]] = {}
+        # sorted days with a non-empty bucket
+        self.days: List[int] = []
+        self.size = 0
+
+    def add(self, trade: Trade):
+        day = session_day(trade.order.instrument.expiration)
+        bucket = self.buckets.get(day)
+        if bucket is None:
+            bucket = self.buckets[day] = {}
+            insort(self.days, day)
+        bucket[trade.order.id] = trade
+        self.size += 1
+
+    def remove(self, trade: Trade):
+        day = session_day(trade.order.instrument.expiration)
+        bucket = self.buckets[day]
+        del bucket[trade.order.id]
+        self.size -= 1
+        if not bucket:
+            del self.buckets[day]
+            del self.days[bisect_left(self.days, day)]
+
+    def expiring(self, day: int) -> List[Trade]:
+        """
+        Trades expiring on or before the given session day, earliest expiry first.
+        """
+        return [trade for expiry in self.days[:bisect_right(self.days, day)]
+                for trade in self.buckets[expiry].values()]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[Trade]:
+        for day in self.days:
+            yield from self.buckets[day].values()
 
 
 class OptionStrategy:
 
-    def __init__(self, name: str, product: str, cash: float):
+    def __init__(self, name: str, product: str, cash: float,
+                 snap_strike_pct: Optional[float] = None):
         # Built-in strategy states
         # User should not modify
         self.next_order_id: int = 0
-        self.time: datetime = datetime.fromtimestamp(0)
+        self.time: int = 0
         self.cash: float = cash
         self.option_premium_sum: float = 0
         self.positions: Dict[Union[Option, str], int] = {}
-        self.pending_orders: List[Order] = []
+        self.order_book = OrderBook()
         self.trades: List[Trade] = []
-        self.trades_option_open: List[Trade] = []
+        self.trades_option_open = OpenOptionTrades()
         self.trades_option_expired: List[Trade] = []
         self.trades_option_assigned: List[Trade] = []
         self.product: str = product
         self.product_val: float = 0.0
+        self.option_chain: OptionChain = OptionChain()
+        self.market: Optional[TickData] = None
+        # max distance listed_strike() may move a strike, as a fraction of it, None disables snapping
+        self.snap_strike_pct = snap_strike_pct
 
         # Stats
         self.name: str = name
-        self.log_file = open(f"tmp/{name}.log", "w")
-        self.asset_value_history: List[Tuple[datetime, float]] = []
-        self.stock_value_history: List[Tuple[datetime, float]] = []
-        self.option_premium_history: List[Tuple[datetime, float]] = []
+        # see Pricer.logger
+        self.logger = Logger()
+        self.asset_value_history = ValueHistory()
+        self.stock_value_history = ValueHistory()
+        self.option_premium_history = ValueHistory()
 
     # Helper functions
 
@@ -38,13 +122,14 @@ class OptionStrategy:
         return len(self.trades_option_open) + len(self.trades_option_assigned) + len(self.trades_option_expired)
 
     def log_stats(self):
-        logger.info(f"Strategy stats:")
+        self.logger.info("Strategy stats:")
         avg_premium = 0.0 if self.num_option_trades == 0 else round_to_cent(
             self.option_premium_sum / self.num_option_trades)
-        logger.info(
-            f"\tTrades: {len(self.trades_option_open)} open, {len(self.trades_option_assigned)} assigned, {len(self.trades_option_expired)} expired, avg premium = ${avg_premium}")
-        logger.info(f"\tCash: ${self.cash:.2f}")
-        logger.info(f"\tPosition: {self.positions}")
+        self.logger.info("\tTrades: %d open, %d assigned, %d expired, avg premium = $%s",
+                         len(self.trades_option_open), len(self.trades_option_assigned),
+                         len(self.trades_option_expired), avg_premium)
+        self.logger.info("\tCash: $%.2f", self.cash)
+        self.logger.info("\tPosition: %s", self.positions)
 
     def add_position(self, instrument: Union[Option, str], qty: int):
         if instrument not in self.positions:
@@ -57,27 +142,86 @@ class OptionStrategy:
     def holding_stock(self) -> bool:
         return (self.product in self.positions and self.positions[self.product] > 0)
 
+    def price_of(self, symbol: str) -> float:
+        """
+        Latest price of any replayed underlying, e.g. "VIX".
+        NaN until the underlying has a bar, or if it is not replayed.
+        """
+        if self.market is None or symbol not in self.market.symbol_index:
+            return math.nan
+        return self.market.price(symbol)
+
+    def listed_strike(self, call: bool, dte: int, strike: float) -> float:
+        """
+        Snap a strike to the nearest one quoted for the expiry `dte` days out, if
+        snapping is enabled with snap_strike_pct and the quoted strike is within
+        snap_strike_pct of it. Returns the strike unchanged otherwise, e.g. when the
+        expiry has no quotes or the chain is too sparse around the strike.
+        """
+        if self.snap_strike_pct is None:
+            return strike
+        expiration = to_expiration(session_day(self.time) + dte)
+        nearest = self.option_chain.nearest_strike(
+            self.product, expiration, call, strike)
+        if nearest is None or abs(nearest - strike) > self.snap_strike_pct * strike:
+            return strike
+        return nearest
+
     # Market access
 
-    def send_order_option(self, buy: bool, call: bool, dte: int, strike: int, qty: int):
+    @property
+    def pending_orders(self) -> List[Order]:
+        return list(self.order_book)
+
+    def send_order_option(self, buy: bool, call: bool, dte: int, strike: int, qty: int,
+                          price: float = 0) -> int:
         """
-        Place an option order. The order is queued in pending_orders and will be handled by the backtest framework.
+        Place an option order, a limit order if price > 0, a market order otherwise.
+        The order rests in order_book and will be handled by the backtest framework.
+        Returns the order id.
         """
-        expiration = to_expiration(self.time + timedelta(days=dte))
+        expiration = to_expiration(session_day(self.time) + dte)
         option = Option(self.product, call, expiration, strike)
         order = Order(self.next_order_id, buy, self.product,
-                      InstrumentType.OPTION, 0, qty, option)
+                      InstrumentType.OPTION, price, qty, option)
         self.next_order_id += 1
-        self.pending_orders.append(order)
+        self.order_book.add(order)
+        return order.id
 
-    def send_order_stock(self, buy: bool, price: float, qty: int):
+    def send_order_stock(self, buy: bool, price: float, qty: int) -> int:
         """
-        Place a stock order. The order is queued in pending_orders and will be handled by the backtest framework.
+        Place a stock order. The order rests in order_book and will be handled by the backtest framework.
+        Returns the order id.
         """
         order = Order(self.next_order_id, buy, self.product,
                       InstrumentType.STOCK, price, qty, self.product)
         self.next_order_id += 1
-        self.pending_orders.append(order)
+        self.order_book.add(order)
+        return order.id
+
+    def cancel_order(self, order_id: int) -> bool:
+        """
+        Cancel a resting order. Returns False if it was already filled or cancelled.
+        """
+        order = self.order_book.cancel(order_id)
+        if order:
+            self.logger.info("Order id=%d cancelled", order_id)
+        return order is not None
+
+    def replace_order(self, order_id: int, price: Optional[float] = None,
+                      qty: Optional[int] = None) -> bool:
+        """
+        Change the limit and/or qty of a resting order, keeping its id.
+        Returns False if it was already filled or cancelled.
+        """
+        order = self.order_book.cancel(order_id)
+        if order is None:
+            return False
+        order = replace(order, price=order.price if price is None else price,
+                        qty=order.qty if qty is None else qty)
+        self.order_book.add(order)
+        self.logger.info("Order id=%d replaced by %s", order_id, order)
+        return True
 
     # Market events
 
@@ -85,8 +229,8 @@ class OptionStrategy:
         """
         Handler for order execution.
         """
-        logger.info(
-            f"Order id={trade.order.id} filled at ${trade.price} x {trade.qty}qty")
+        self.logger.info("Order id=%d filled at $%s x %sqty",
+                         trade.order.id, trade.price, trade.qty)
         order = trade.order
         if order.buy:
             self.cash -= trade.premium
@@ -99,14 +243,14 @@ class OptionStrategy:
                 self.option_premium_sum += trade.premium
             self.add_position(order.instrument, -1 * trade.qty)
         if order.is_option:
-            self.trades_option_open.append(trade)
+            self.trades_option_open.add(trade)
 
     def assignment_event(self, trade: Trade, spot_price: float):
         """
         Handler for option assignment.
         """
-        logger.info(
-            f"Assigned {trade.order.instrument}, spot price = ${spot_price}")
+        self.logger.info("Assigned %s, spot price = $%s",
+                         trade.order.instrument, spot_price)
         order = trade.order
         # we must have sold an option
         assert order.is_option
@@ -141,20 +285,22 @@ class OptionStrategy:
         # track daily NAV
         stock_value = self.positions.get(self.product, 0) * self.product_val
         nav = self.cash + stock_value
-        self.asset_value_history.append((self.time, nav))
-        self.stock_value_history.append((self.time, stock_value))
-        self.option_premium_history.append(
-            (self.time, self.option_premium_sum))
+        self.asset_value_history.append(self.time, nav)
+        self.stock_value_history.append(self.time, stock_value)
+        self.option_premium_history.append(self.time, self.option_premium_sum)
 
-    def tick_event(self, time: datetime, price: float):
+    def tick_event(self, time: int, price: float, tick: Optional[TickData] = None):
         """
-        Handler for tick data update.
+        Handler for tick data update, tick is used as in Pricer.val_event().
         """
         self.time = time
         self.product_val = price
+        if tick is not None:
+            self.market = tick
+            self.option_chain = tick.option_prices
         self.tick_logic(time, price)
 
     # Interfaces to be implemented by subclasses
 
-    def tick_logic(self, time: datetime, price: float):
+    def tick_logic(self, time: int, price: float):
         raise TypeError("Base class tick_logic is virtual!")
@@ -0,0 +1,205 @@
+import argparse
+import csv
+import heapq
+import os
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from clock import session_day
+import optionstore
+from tick import (MarketDataLoader, MarketDataSource, OptionSources, StockData, group_chains,
+                  option_paths)
+
+T = TypeVar("T")
+
+# scraper rows may trail the poll time by up to 8h, see yfinance_scraper.py
+DEFAULT_MAX_DELAY = timedelta(hours=8)
+
+
+@dataclass
+class MergeStats:
+    """
+    Per-source row counters of a streaming merge, indexed by source, so the
+    same file passed twice is counted twice.
+    """
+    names: List[str] = field(default_factory=list)
+    rows: List[int] = field(default_factory=list)
+    late: List[int] = field(default_factory=list)
+    # stock bars dropped because an earlier file had a bar at the same time
+    duplicate_bars: int = 0
+
+    def add_source(self, name: str) -> int:
+        """
+        Start counting a source, returns its index.
+        """
+        self.names.append(name)
+        self.rows.append(0)
+        self.late.append(0)
+        return len(self.names) - 1
+
+    def __str__(self):
+        return ", ".join(
+            [f"{name}: {rows} rows, {late} late"
+             for name, rows, late in zip(self.names, self.rows, self.late)]
+            + [f"{self.duplicate_bars} duplicate bars"])
+
+
+def reorder(rows: Iterable[Tuple[int, T]], max_delay: timedelta, stats: MergeStats,
+            source: int) -> Iterator[Tuple[int, T]]:
+    """
+    Sort a nearly sorted (timestamp, row) stream with a bounded buffer.
+    A row is held until a row more than max_delay newer has been read, so memory is
+    bounded by the rows within max_delay. Rows older than an already emitted row
+    arrived too late, they are dropped and counted in stats under source,
+    see MergeStats.add_source().
+    """
+    delay = int(max_delay.total_seconds())
+    heap: List[Tuple[int, int, T]] = []
+    emitted = None
+    latest = None
+    for seq, (timestamp, row) in enumerate(rows):
+        stats.rows[source] += 1
+        if emitted is not None and timestamp < emitted:
+            stats.late[source] += 1
+            continue
+        # seq keeps file order for equal timestamps
+        heapq.heappush(heap, (timestamp, seq, row))
+        latest = timestamp if latest is None else max(latest, timestamp)
+        while heap and heap[0][0] < latest - delay:
+            emitted, _, ready = heapq.heappop(heap)
+            yield emitted, ready
+    while heap:
+        emitted, _, ready = heapq.heappop(heap)
+        yield emitted, ready
+
+
+def merge(streams: List[Iterator[Tuple[int, T]]]) -> Iterator[Tuple[int, T]]:
+    """
+    K-way merge of time-sorted streams, ties keep the order of the streams.
+    """
+    return heapq.merge(*streams, key=lambda item: item[0])
+
+
+def unique_times(rows: Iterator[Tuple[int, T]], stats: MergeStats) -> Iterator[Tuple[int, T]]:
+    """
+    Drop rows with the same timestamp as the previous one from a time-sorted
+    stream, e.g. bars of overlapping stock shards. The first file's bar wins.
+    """
+    previous = None
+    for timestamp, row in rows:
+        if timestamp == previous:
+            stats.duplicate_bars += 1
+            continue
+        previous = timestamp
+        yield timestamp, row
+
+
+def _stock_rows(filename: str) -> Iterator[Tuple[int, Tuple[float, float, float, float]]]:
+    with open(filename, 'r') as f:
+        for row in csv.DictReader(f):
+            yield int(row['time']), (float(row['open']), float(row['high']),
+                                     float(row['low']), float(row['close']))
+
+
+def _option_rows(filename: str) -> Iterator[Tuple[int, Tuple[str, float, float, float, float, int]]]:
+    with open(filename, 'r') as f:
+        for row in csv.DictReader(f):
+            yield int(row['timestamp']), (
+                row['contractSymbol'],
+                float(row['bid']) if row['bid'] else 0.0,
+                float(row['ask']) if row['ask'] else 0.0,
+                float(row['lastPrice']),
+                float(row['impliedVolatility']),
+                int(row['volume']) if row['volume'] else 0,
+            )
+
+
+def _store_rows(root: str) -> Iterator[Tuple[int, Tuple[str, float, float, float, float, int]]]:
+    # one chunk in memory at a time
+    for columns in optionstore.chunks(root):
+        symbols = columns.symbols.tolist()
+        yield from zip(columns.time.tolist(), zip(
+            [symbols[i] for i in columns.symbol.tolist()], columns.bid.tolist(),
+            columns.ask.tolist(), columns.last.tolist(), columns.iv.tolist(),
+            columns.volume.tolist()))
+
+
+def _option_source_rows(path: str
+                        ) -> Iterator[Tuple[int, Tuple[str, float, float, float, float, int]]]:
+    return _store_rows(path) if os.path.isdir(path) else _option_rows(path)
+
+
+class MarketDataStream(MarketDataSource):
+    """
+    Single-pass market data merged from any number of stock and option files,
+    e.g. daily scraper shards of several symbols. Option sources may be CSV
+    files or option store directories, as a list or by symbol, see OptionSources.
+    Sources are read lazily, CSVs row by row and stores chunk by chunk, each
+    through a bounded reorder buffer, and k-way merged by timestamp, so nothing
+    is loaded whole or pre-sorted in memory.
+
+    The stock files drive the replay, like MarketData's stock file. Underlyings
+    map symbols to the stock files of other underlyings, e.g. {"QQQ": [...],
+    "VIX": [...]}. Each underlying's files must all be bars of it, overlapping
+    shards replay each bar time once.
+    """
+
+    def __init__(self, stock_filenames: List[str], option_filenames: OptionSources,
+                 max_delay: timedelta = DEFAULT_MAX_DELAY, product: str = "",
+                 underlyings: Optional[Dict[str, List[str]]] = None):
+        self.stats = MergeStats()
+        option_rows = merge([
+            reorder(_option_source_rows(path), max_delay, self.stats, self.stats.add_source(path))
+            for path in option_paths(option_filenames)])
+        super().__init__(
+            self._bars(stock_filenames, max_delay),
+            group_chains((timestamp, *row) for timestamp, row in option_rows),
+            product,
+            {symbol: self._bars(filenames, max_delay)
+             for symbol, filenames in (underlyings or {}).items() if symbol != product})
+        self.used = False
+
+    def _bars(self, filenames: List[str], max_delay: timedelta) -> Iterator[StockData]:
+        """
+        Merged bars of one underlying's stock files.
+        """
+        rows = unique_times(
+            merge([reorder(_stock_rows(filename), max_delay, self.stats,
+                           self.stats.add_source(filename)) for filename in filenames]),
+            self.stats)
+        return (StockData(time=timestamp, open=open, high=high, low=low, close=close,
+                          day=session_day(timestamp))
+                for timestamp, (open, high, low, close) in rows)
+
+    def cursor(self, align_to_bars: bool = False) -> MarketDataLoader:
+        """
+        The one cursor replaying this stream, streams can only be replayed once.
+        """
+        assert not self.used, "MarketDataStream can only be replayed once"
+        self.used = True
+        return MarketDataLoader(data=self, align_to_bars=align_to_bars)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay merged stock and option files and report merge stats.")
+    parser.add_argument("--stock", nargs="+", required=True)
+    parser.add_argument("--product", default="", help="symbol of the --stock bars")
+    parser.add_argument("--underlying", nargs="+", action="append", default=[],
+                        metavar=("SYMBOL", "FILE"),
+                        help="bars of another underlying, e.g. --underlying VIX data/VIX-....csv")
+    parser.add_argument("--options", nargs="*", default=[],
+                        help="option CSV files or option store directories")
+    parser.add_argument("--max-delay-minutes", type=int,
+                        default=int(DEFAULT_MAX_DELAY.total_seconds() // 60))
+    args = parser.parse_args()
+
+    stream = MarketDataStream(args.stock, args.options,
+                              timedelta(minutes=args.max_delay_minutes), args.product,
+                              {symbol: filenames for symbol, *filenames in args.underlying})
+    md = stream.cursor()
+    while md.has_next_tick:
+        md.next_tick()
+    print(f"Replayed {md.tick_count} ticks")
+    print(stream.stats)
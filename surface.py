@@ -0,0 +1,172 @@
+import math
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from tick import ExpiryQuotes, OptionChain, OptionData
+
+SMILE_DEGREE = 2
+MIN_QUOTES = 5
+MIN_IV = 0.01
+MAX_IV = 2.0
+
+
+@dataclass
+class Smile:
+    """
+    Implied vol smile of one expiry: a polynomial in log-moneyness log(K / spot).
+    Strikes outside the fitted range get the vol at the nearest edge.
+    """
+    spot: float
+    coeffs: List[float]  # highest power first
+    k_min: float
+    k_max: float
+
+    def vol(self, strike: float) -> float:
+        k = min(max(math.log(strike / self.spot), self.k_min), self.k_max)
+        vol = 0.0
+        for c in self.coeffs:
+            vol = vol * k + c
+        return max(vol, MIN_IV)
+
+    def vols(self, strikes: np.ndarray) -> np.ndarray:
+        k = np.clip(np.log(strikes / self.spot), self.k_min, self.k_max)
+        return np.maximum(np.polyval(self.coeffs, k), MIN_IV)
+
+
+def fit_smile(spot: float, strikes: np.ndarray, calls: np.ndarray, ivs: np.ndarray,
+              bids: np.ndarray, asks: np.ndarray, volumes: np.ndarray) -> Optional[Smile]:
+    """
+    Fit a smile to the quotes of one expiry by weighted least squares.
+    Only OTM options with a valid two-sided quote and a sane IV are used,
+    deep ITM quotes on Yahoo carry junk IVs. Weighted by sqrt(1 + volume).
+    Returns None if there are not enough usable quotes.
+    """
+    otm = np.where(calls, strikes >= spot, strikes <= spot)
+    usable = otm & (bids > 0) & (asks > bids) & (ivs > MIN_IV) & (ivs < MAX_IV)
+    if np.count_nonzero(usable) < MIN_QUOTES:
+        return None
+    k = np.log(strikes[usable] / spot)
+    coeffs = np.polyfit(k, ivs[usable], SMILE_DEGREE,
+                        w=np.sqrt(1.0 + volumes[usable]))
+    return Smile(spot, coeffs.tolist(), float(k.min()), float(k.max()))
+
+
+class VolSurface:
+    """
+    Implied vol surface fitted from market quotes, one smile per product and listed expiry.
+    Refitted lazily on the first lookup after the option chain changes, and then
+    only for expiries whose quotes changed. Lookups for listed expiries are O(1),
+    unlisted expiries are interpolated linearly in total variance between the
+    neighboring smiles.
+    """
+
+    def __init__(self):
+        self.version = -1
+        self.time = 0
+        # chain to fit on the next lookup
+        self.pending: Optional[Tuple[Mapping[str, OptionData], float, Mapping[str, float]]] = None
+        self.smiles: Dict[Tuple[str, int], Smile] = {}
+        # product -> sorted expiries with a smile
+        self.expirations: Dict[str, List[int]] = {}
+        # (product, expiry) -> quote bucket of the last fit, to skip unchanged expiries
+        self.buckets: Dict[Tuple[str, int], ExpiryQuotes] = {}
+
+    def update(self, option_prices: Mapping[str, OptionData], version: int, spot: float,
+               time: int, spots: Optional[Mapping[str, float]] = None):
+        """
+        Handler for a new tick, marks the surface for refit if the option chain version changed.
+        Smiles are fitted against spots[product] if given, spot otherwise.
+        """
+        self.time = time
+        if version == self.version:
+            return
+        self.version = version
+        self.pending = (option_prices, spot, spots or {})
+
+    def fit(self):
+        """
+        Refit smiles to the pending option chain. Expiry buckets are shared between
+        chain versions until their quotes change, so only new buckets are refitted.
+        """
+        assert self.pending
+        option_prices, spot, spots = self.pending
+        self.pending = None
+        time = self.time
+        chain = option_prices if isinstance(option_prices, OptionChain) \
+            else OptionChain().updated(option_prices, time)
+
+        smiles: Dict[Tuple[str, int], Smile] = {}
+        buckets: Dict[Tuple[str, int], ExpiryQuotes] = {}
+        for key, bucket in chain.buckets.items():
+            # skip expired contracts
+            if key[1] < time:
+                continue
+            buckets[key] = bucket
+            if self.buckets.get(key) is bucket:
+                # unchanged since the last fit
+                if key in self.smiles:
+                    smiles[key] = self.smiles[key]
+                continue
+            quotes = bucket.columns()
+            smile = fit_smile(spots.get(key[0], spot), quotes.strikes, quotes.calls,
+                              quotes.ivs, quotes.bids, quotes.asks, quotes.volumes)
+            if smile:
+                smiles[key] = smile
+        self.smiles = smiles
+        self.buckets = buckets
+        self.expirations = {}
+        for product, expiration in sorted(smiles):
+            self.expirations.setdefault(product, []).append(expiration)
+
+    def _neighbors(self, product: str, expiration: int) -> Optional[Tuple[float, Smile, float, Smile, float]]:
+        """
+        Smiles bracketing an unlisted expiry, with seconds to each expiry.
+        """
+        expirations = self.expirations.get(product, [])
+        i = bisect_left(expirations, expiration)
+        if i == 0 or i == len(expirations) or expiration <= self.time:
+            return None
+        e0, e1 = expirations[i - 1], expirations[i]
+        t0 = e0 - self.time
+        t1 = e1 - self.time
+        t = expiration - self.time
+        if t0 <= 0:
+            return None
+        return t0, self.smiles[(product, e0)], t1, self.smiles[(product, e1)], t
+
+    def vol(self, product: str, expiration: int, strike: float) -> Optional[float]:
+        """
+        Market implied vol for an option, or None if the surface does not cover it.
+        """
+        if self.pending:
+            self.fit()
+        smile = self.smiles.get((product, expiration))
+        if smile:
+            return smile.vol(strike)
+        neighbors = self._neighbors(product, expiration)
+        if not neighbors:
+            return None
+        t0, smile0, t1, smile1, t = neighbors
+        w0 = smile0.vol(strike) ** 2 * t0
+        w1 = smile1.vol(strike) ** 2 * t1
+        return math.sqrt((w0 + (w1 - w0) * (t - t0) / (t1 - t0)) / t)
+
+    def vols(self, product: str, expiration: int, strikes: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Vectorized vol() for many strikes of one expiry.
+        """
+        if self.pending:
+            self.fit()
+        smile = self.smiles.get((product, expiration))
+        if smile:
+            return smile.vols(strikes)
+        neighbors = self._neighbors(product, expiration)
+        if not neighbors:
+            return None
+        t0, smile0, t1, smile1, t = neighbors
+        w0 = smile0.vols(strikes) ** 2 * t0
+        w1 = smile1.vols(strikes) ** 2 * t1
+        return np.sqrt((w0 + (w1 - w0) * (t - t0) / (t1 - t0)) / t)
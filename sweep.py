@@ -0,0 +1,155 @@
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+from backtest import backtest
+from price import INTEREST_RATE, Pricer
+from strategy import *
+from tick import MarketData
+
+# strategy name -> (class, sweepable parameters)
+STRATEGIES: Dict[str, Tuple[Type[OptionStrategy], List[str]]] = {
+    "wheel": (WheelStrategy, ["dte", "put_otm_pct", "call_otm_pct"]),
+    "sell-put": (SellPutStrategy, ["dte", "put_otm_pct"]),
+    "covered-call": (SellCoveredCallStrategy, ["dte", "call_otm_pct"]),
+}
+
+
+@dataclass
+class SweepResult:
+    """
+    Summary of one backtest in a parameter sweep.
+    """
+    name: str
+    params: Dict[str, Any]
+    nav: float
+    premium: float
+    assignments: int
+    max_drawdown: float  # fraction of the running peak NAV
+
+
+def expand_grid(grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """
+    Expand {param: [values]} into the list of all parameter combinations.
+    """
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+
+def max_drawdown(history: Iterable[Tuple[Any, float]]) -> float:
+    """
+    Largest peak-to-trough drop of a value history, as a fraction of the peak.
+    """
+    peak = 0.0
+    drawdown = 0.0
+    for _, value in history:
+        peak = max(peak, value)
+        if peak > 0:
+            drawdown = max(drawdown, (peak - value) / peak)
+    return drawdown
+
+
+# forked workers inherit the parent's market data, without fork it is pickled to each worker
+_POOL_CONTEXT = multiprocessing.get_context(
+    "fork") if "fork" in multiprocessing.get_all_start_methods() else None
+
+# market data of this worker, the parent's MarketData
+_worker_data: Optional[MarketData] = None
+
+
+def _init_worker(data: MarketData):
+    global _worker_data
+    _worker_data = data
+
+
+def _run_one(strategy_name: str, params: Dict[str, Any], product: str, cash: float,
+             rate: float, align_to_bars: bool) -> SweepResult:
+    assert _worker_data, "Worker not initialized"
+    strategy_cls, _ = STRATEGIES[strategy_name]
+    name = strategy_name + "".join(f"-{k}={v}" for k, v in params.items())
+    strategy = strategy_cls(name, product, cash, **params)
+    backtest(strategy, Pricer(rate), _worker_data.cursor(align_to_bars))
+    return SweepResult(
+        name=name,
+        params=params,
+        nav=strategy.asset_value_history[-1][1] if strategy.asset_value_history else cash,
+        premium=strategy.option_premium_sum,
+        assignments=len(strategy.trades_option_assigned),
+        max_drawdown=max_drawdown(strategy.asset_value_history),
+    )
+
+
+def sweep(strategy_name: str, grid: Dict[str, List[Any]], stock_filename: str, option_filename: str,
+          product: str = "SPY", cash: float = 50000, rate: float = INTEREST_RATE,
+          workers: Optional[int] = None, align_to_bars: bool = True) -> List[SweepResult]:
+    """
+    Backtest a strategy over every combination of the parameter grid in a process pool.
+    The market data is loaded once in this process and forked into the workers,
+    which replay the same memory-mapped columns read-only. Results are returned in grid order.
+    """
+    data = MarketData(stock_filename, option_filename)
+    combos = expand_grid(grid)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_POOL_CONTEXT,
+                             initializer=_init_worker, initargs=(data,)) as pool:
+        futures = [pool.submit(_run_one, strategy_name, params, product, cash, rate, align_to_bars)
+                   for params in combos]
+        return [future.result() for future in futures]
+
+
+def print_results(results: List[SweepResult]):
+    """
+    Print a summary table, best final NAV first.
+    """
+    print("-" * 100)
+    print(f"{'Strategy':<50} | {'NAV':>12} | {'Premium':>10} | {'Assigned':>8} | {'Max DD':>7}")
+    print("-" * 100)
+    for result in sorted(results, key=lambda r: r.nav, reverse=True):
+        print(f"{result.name:<50} | ${result.nav:>11.2f} | ${result.premium:>9.2f} | "
+              f"{result.assignments:>8} | {result.max_drawdown * 100:>6.2f}%")
+    print("-" * 100)
+
+
+def save_results(results: List[SweepResult], path: str):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        params = list(results[0].params) if results else []
+        writer.writerow(["name", *params, "nav", "premium", "assignments", "max_drawdown"])
+        for result in results:
+            writer.writerow([result.name, *(result.params[p] for p in params), result.nav,
+                             result.premium, result.assignments, result.max_drawdown])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backtest a strategy over a parameter grid in parallel.")
+    parser.add_argument("strategy", choices=list(STRATEGIES))
+    parser.add_argument("--stock", default="data/SPY-202507-15min.csv")
+    parser.add_argument("--options", default="data/SPY-options.csv")
+    parser.add_argument("--product", default="SPY")
+    parser.add_argument("--cash", type=float, default=50000)
+    parser.add_argument("--dte", type=int, nargs="+", default=[0, 1, 7])
+    parser.add_argument("--put-otm-pct", type=float, nargs="+", default=[0.01, 0.02])
+    parser.add_argument("--call-otm-pct", type=float, nargs="+", default=[0.01, 0.02])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--tick-per-option-update", action="store_true",
+                        help="replay every option timestamp as a tick instead of one tick per stock bar")
+    parser.add_argument("--out", default=None,
+                        help="CSV summary path, defaults to tmp/sweep-{strategy}.csv")
+    args = parser.parse_args()
+
+    _, param_names = STRATEGIES[args.strategy]
+    grid = {name: getattr(args, name) for name in param_names}
+    print(f"Sweeping {args.strategy} over {len(expand_grid(grid))} combinations "
+          f"with {args.workers} workers ...")
+    results = sweep(args.strategy, grid, args.stock, args.options, product=args.product,
+                    cash=args.cash, workers=args.workers,
+                    align_to_bars=not args.tick_per_option_update)
+    print_results(results)
+    out = args.out or f"tmp/sweep-{args.strategy}.csv"
+    save_results(results, out)
+    print(f"Saved sweep summary to {out}")
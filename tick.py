@@ -1,13 +1,22 @@
-import csv
-from dataclasses import dataclass
-from datetime import datetime
-from typing import Dict, Iterator, Optional
-from zoneinfo import ZoneInfo
+import math
+import os
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 
+import numpy as np
 
-@dataclass
+from cache import (OPTION_FIELDS, STOCK_FIELDS, OptionColumns, StockColumns,
+                   load_option_columns, load_stock_columns)
+from clock import session_day, session_days, to_datetime
+from instrument import Option, parse_symbol
+import optionstore
+
+
+@dataclass(frozen=True, slots=True)
 class OptionData:
-    time: datetime
+    time: int
     bid: float
     ask: float
     last: float
@@ -15,100 +24,447 @@ class OptionData:
     volume: int
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class StockData:
-    time: datetime
+    time: int
     high: float
     low: float
     open: float
     close: float
+    # session day id of the bar, for EOD detection
+    day: int = 0
+
+
+@dataclass(frozen=True, slots=True)
+class ExpiryColumns:
+    """
+    Columnar quotes of one expiry, in quote order.
+    """
+    strikes: np.ndarray
+    calls: np.ndarray
+    ivs: np.ndarray
+    bids: np.ndarray
+    asks: np.ndarray
+    volumes: np.ndarray
+
+
+class ExpiryQuotes:
+    """
+    Quotes of a single product and expiry. Never modified once part of an OptionChain.
+    """
+
+    def __init__(self, quotes: Dict[str, OptionData]):
+        self.quotes = quotes
+        # call -> sorted strikes and their symbols, built on first query
+        self.index: Optional[Dict[bool, Tuple[List[float], List[str]]]] = None
+        # built on first query
+        self.arrays: Optional[ExpiryColumns] = None
+
+    def columns(self) -> ExpiryColumns:
+        if self.arrays is None:
+            terms = [parse_symbol(symbol) for symbol in self.quotes]
+            quotes = self.quotes.values()
+            self.arrays = ExpiryColumns(
+                strikes=np.array([strike for _, _, _, strike in terms], dtype=np.float64),
+                calls=np.array([call for _, _, call, _ in terms], dtype=bool),
+                ivs=np.array([quote.iv for quote in quotes], dtype=np.float64),
+                bids=np.array([quote.bid for quote in quotes], dtype=np.float64),
+                asks=np.array([quote.ask for quote in quotes], dtype=np.float64),
+                volumes=np.array([quote.volume for quote in quotes], dtype=np.float64),
+            )
+        return self.arrays
+
+    def strikes(self, call: bool) -> Tuple[List[float], List[str]]:
+        if self.index is None:
+            self.index = {True: ([], []), False: ([], [])}
+            for symbol in sorted(self.quotes, key=lambda s: parse_symbol(s)[3]):
+                _, _, is_call, strike = parse_symbol(symbol)
+                strikes, symbols = self.index[is_call]
+                strikes.append(strike)
+                symbols.append(symbol)
+        return self.index[call]
+
 
+class OptionChain(Mapping[str, OptionData]):
+    """
+    Immutable snapshot of the latest option quotes, keyed by OCC symbol.
+    Quotes are bucketed by (product, expiration). A new version only copies the
+    buckets that changed and shares the rest, so every tick can hold its own
+    snapshot cheaply, and expired contracts are dropped a whole bucket at a time.
+    Each bucket keeps sorted strikes for O(log n) nearest-strike and range queries.
+    """
+
+    def __init__(self, buckets: Optional[Dict[Tuple[str, int], ExpiryQuotes]] = None):
+        self.buckets: Dict[Tuple[str, int], ExpiryQuotes] = buckets or {}
+        self.size = sum(len(bucket.quotes) for bucket in self.buckets.values())
+        # earliest expiration, the chain is stale once time passes it
+        self.next_expiration: Optional[int] = min(
+            (expiration for _, expiration in self.buckets), default=None)
+
+    def __getitem__(self, symbol: str) -> OptionData:
+        product, expiration, _, _ = parse_symbol(symbol)
+        bucket = self.buckets.get((product, expiration))
+        if bucket is None:
+            raise KeyError(symbol)
+        return bucket.quotes[symbol]
 
-# TODO: only advance stock time and gather options before each stock time
+    def __iter__(self) -> Iterator[str]:
+        for bucket in self.buckets.values():
+            yield from bucket.quotes
 
-@dataclass
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
+
+    def updated(self, chain: Mapping[str, OptionData], time: int) -> "OptionChain":
+        """
+        New version with newer quotes merged in, and contracts expired before time dropped.
+        This version is left untouched.
+        """
+        buckets = {key: bucket for key, bucket in self.buckets.items()
+                   if key[1] >= time}
+        changes: Dict[Tuple[str, int], Dict[str, OptionData]] = {}
+        for symbol, quote in chain.items():
+            product, expiration, _, _ = parse_symbol(symbol)
+            if expiration >= time:
+                changes.setdefault((product, expiration), {})[symbol] = quote
+        for key, quotes in changes.items():
+            if key in buckets:
+                # copy on write
+                quotes = {**buckets[key].quotes, **quotes}
+            buckets[key] = ExpiryQuotes(quotes)
+        return OptionChain(buckets)
+
+    # Queries
+
+    def quote(self, option: Option) -> Optional[OptionData]:
+        """
+        Exact lookup, O(1).
+        """
+        bucket = self.buckets.get((option.product, option.expiration))
+        return bucket.quotes.get(option.symbol) if bucket else None
+
+    def expirations(self, product: str) -> List[int]:
+        """
+        Listed expirations for a product, sorted.
+        """
+        return sorted(expiration for p, expiration in self.buckets if p == product)
+
+    def strikes(self, product: str, expiration: int, call: bool) -> List[float]:
+        """
+        Listed strikes for an expiry, sorted.
+        """
+        bucket = self.buckets.get((product, expiration))
+        return list(bucket.strikes(call)[0]) if bucket else []
+
+    def nearest_strike(self, product: str, expiration: int, call: bool,
+                       strike: float) -> Optional[float]:
+        """
+        Listed strike closest to the given one, or None if the expiry has no quotes.
+        Ties go to the lower strike.
+        """
+        bucket = self.buckets.get((product, expiration))
+        strikes = bucket.strikes(call)[0] if bucket else []
+        if not strikes:
+            return None
+        i = bisect_left(strikes, strike)
+        if i == len(strikes):
+            return strikes[-1]
+        if i > 0 and strike - strikes[i - 1] <= strikes[i] - strike:
+            return strikes[i - 1]
+        return strikes[i]
+
+    def strike_range(self, product: str, expiration: int, call: bool,
+                     low: float, high: float) -> List[Tuple[float, OptionData]]:
+        """
+        Quotes with low <= strike <= high for an expiry, sorted by strike.
+        """
+        bucket = self.buckets.get((product, expiration))
+        if not bucket:
+            return []
+        strikes, symbols = bucket.strikes(call)
+        lo = bisect_left(strikes, low)
+        hi = bisect_right(strikes, high, lo=lo)
+        return [(strikes[i], bucket.quotes[symbols[i]]) for i in range(lo, hi)]
+
+
+@dataclass(frozen=True, slots=True)
 class TickData:
     """
     Snapshot of the market combining both stock and options.
     """
-    time: datetime
+    time: int
+    # session day id
+    day: int
     stock_price: StockData
-    option_prices: Dict[str, OptionData]
+    option_prices: OptionChain
+    # incremented whenever option_prices changes
+    option_version: int = 0
+    # latest bar open of every replayed underlying, NaN before its first bar
+    prices: np.ndarray = field(default_factory=lambda: np.empty(0))
+    # symbol -> index into prices, shared by all ticks of a replay
+    symbol_index: Mapping[str, int] = field(default_factory=dict)
+
+    def price(self, symbol: str) -> float:
+        """
+        Latest price of any replayed underlying, e.g. tick.price("VIX").
+        """
+        return float(self.prices[self.symbol_index[symbol]])
+
+    def spots(self) -> Dict[str, float]:
+        """
+        Latest prices of all underlyings with at least one bar so far.
+        """
+        return {symbol: price for symbol, price in zip(self.symbol_index, self.prices.tolist())
+                if not math.isnan(price)}
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    """
+    Read-only ndarray view, e.g. of a mapped column, faster to index than np.memmap.
+    """
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    return view
+
+
+class StockBars(Sequence[StockData]):
+    """
+    Stock bars over memory-mapped columns, each bar is decoded when read.
+    """
+
+    def __init__(self, columns: StockColumns):
+        self.columns = StockColumns(
+            **{name: _read_only(getattr(columns, name)) for name in STOCK_FIELDS})
+        self.days = _read_only(session_days(self.columns.time))
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def __getitem__(self, index: int) -> StockData:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("StockBars index out of range")
+        columns = self.columns
+        return StockData(
+            time=columns.time.item(index),
+            open=columns.open.item(index),
+            high=columns.high.item(index),
+            low=columns.low.item(index),
+            close=columns.close.item(index),
+            day=self.days.item(index)
+        )
+
+
+def group_chains(rows: Iterable[Tuple[int, str, float, float, float, float, int]]
+                 ) -> Iterator[tuple[int, Mapping[str, OptionData]]]:
+    """
+    Group time-sorted (timestamp, symbol, bid, ask, last, iv, volume) rows
+    into one option chain per timestamp.
+    """
+    current_time = None
+    chain: Dict[str, OptionData] = {}
+    for timestamp, symbol, bid, ask, last, iv, volume in rows:
+        # when we see a new timestamp, yield the current chain
+        if timestamp != current_time:
+            if current_time is not None:
+                yield current_time, MappingProxyType(chain)
+            current_time = timestamp
+            chain = {}
+
+        data = OptionData(
+            time=timestamp,
+            bid=bid,
+            ask=ask,
+            last=last,
+            iv=iv,
+            volume=volume,
+        )
+
+        # check data quality
+        if data.bid == 0 and data.ask == 0:
+            print(
+                f"Found 0x0 option quotes for {symbol} at {to_datetime(timestamp)}, please check data quality!")
+
+        chain[symbol] = data
+
+    if current_time is not None:
+        yield current_time, MappingProxyType(chain)
+
+
+# an option CSV file or store directory, a list of them, or symbol -> file or store,
+# e.g. {"SPY": "data/SPY-options", "QQQ": "data/QQQ-options.csv"}
+type OptionSources = Union[str, Sequence[str], Mapping[str, str]]
+
+
+def option_paths(sources: OptionSources) -> List[str]:
+    """
+    Paths of option sources, in the given order.
+    """
+    if isinstance(sources, str):
+        return [sources]
+    if isinstance(sources, Mapping):
+        return list(sources.values())
+    return list(sources)
+
+
+def _load_option_columns(sources: OptionSources, start: int, end: int) -> OptionColumns:
+    """
+    Option quotes of CSV files, and of the partitions of option store
+    directories (see optionstore.py) overlapping [start, end], merged by time.
+    """
+    parts = [optionstore.load(path, start, end) if os.path.isdir(path) else load_option_columns(path)
+             for path in option_paths(sources)]
+    # a single file stays memory-mapped
+    return parts[0] if len(parts) == 1 else optionstore.merge(parts)
+
+
+class OptionChains(Sequence[tuple[int, Mapping[str, OptionData]]]):
+    """
+    Option chains by timestamp over memory-mapped option columns. Only the
+    row offsets of every timestamp are computed up front, a chain is decoded
+    from its rows when read.
+    """
+
+    def __init__(self, columns: OptionColumns):
+        self.columns = OptionColumns(
+            **{name: _read_only(getattr(columns, name)) for name in OPTION_FIELDS})
+        self.symbols: List[str] = self.columns.symbols.tolist()
+        times = self.columns.time
+        # scraped files are not time-sorted, order rows by time and keep file order on ties
+        self.order: Optional[np.ndarray] = None
+        if np.any(times[1:] < times[:-1]):
+            self.order = _read_only(np.argsort(times, kind='stable'))
+            times = times[self.order]
+        # first sorted row of every timestamp, then the end,
+        # so rows offsets[i]:offsets[i + 1] share a timestamp
+        self.offsets = _read_only(
+            np.append(np.flatnonzero(np.diff(times, prepend=times[:1] - 1)), len(times)))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> tuple[int, Mapping[str, OptionData]]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("OptionChains index out of range")
+        lo, hi = self.offsets.item(index), self.offsets.item(index + 1)
+        rows = slice(lo, hi) if self.order is None else self.order[lo:hi]
+        columns = self.columns
+        symbols = self.symbols
+        return next(group_chains(zip(
+            columns.time[rows].tolist(), [symbols[i] for i in columns.symbol[rows].tolist()],
+            columns.bid[rows].tolist(), columns.ask[rows].tolist(), columns.last[rows].tolist(),
+            columns.iv[rows].tolist(), columns.volume[rows].tolist())))
+
+
+class MarketDataSource:
+    """
+    What a MarketDataLoader replays: time-sorted stock bars driving the replay,
+    time-sorted option chains, and bars of other underlyings joined as of each
+    tick time into TickData.prices, e.g. {"QQQ": ..., "VIX": ...}. Name the
+    stock bars' own symbol with product to have it in TickData.prices too.
+
+    Sources replayed by several cursors hold sequences over read-only arrays,
+    e.g. StockBars and OptionChains. Cursors iterate them by position, so a
+    cursor's own state is its positions and its option chain versions.
+    """
+
+    def __init__(self, stocks: Iterable[StockData],
+                 option_chains: Iterable[tuple[int, Mapping[str, OptionData]]],
+                 product: str = "", underlyings: Optional[Dict[str, Iterable[StockData]]] = None):
+        self.stocks = stocks
+        self.option_chains = option_chains
+        self.product = product
+        self.underlyings: Dict[str, Iterable[StockData]] = {
+            symbol: bars for symbol, bars in (underlyings or {}).items() if symbol != product}
+        self.symbol_index: Mapping[str, int] = MappingProxyType({
+            symbol: i for i, symbol in enumerate(([product] if product else []) + list(self.underlyings))})
+
+    def cursor(self, align_to_bars: bool = False) -> "MarketDataLoader":
+        """
+        Create a cursor replaying this data from the start.
+        """
+        return MarketDataLoader(data=self, align_to_bars=align_to_bars)
+
+
+class MarketData(MarketDataSource):
+    """
+    Immutable market data over the memory-mapped column cache, replayable by any
+    number of cursors. Loading only maps the columns and indexes option rows by
+    timestamp, bars and chains are decoded as cursors reach them.
+    Share one instance across backtests instead of re-loading the same files.
+    Option rows are sorted by time, so unsorted scraper output replays in order.
+
+    The stock file drives the replay. Underlyings map symbols to stock files, e.g.
+    {"QQQ": "data/QQQ-....csv", "VIX": "data/VIX-....csv"}. Option files may hold
+    any products, and may be option store directories, e.g. data/SPY-options.
+    Several option sources, e.g. {"SPY": "data/SPY-options", "QQQ": "data/QQQ-options"},
+    are merged by time.
+    """
+
+    def __init__(self, stock_filename: str, option_filename: OptionSources, product: str = "",
+                 underlyings: Optional[Dict[str, str]] = None):
+        stocks = StockBars(load_stock_columns(stock_filename))
+        # a store only opens the days of the stock bars, the replay ends with the last bar
+        start, end = (stocks[0].time, stocks[-1].time) if stocks else (0, 0)
+        super().__init__(
+            stocks,
+            OptionChains(_load_option_columns(option_filename, start, end)),
+            product,
+            {symbol: StockBars(load_stock_columns(filename))
+             for symbol, filename in (underlyings or {}).items() if symbol != product})
 
 
 class MarketDataLoader:
     """
-    A class to load market data from CSV files.
+    A cursor replaying market data tick by tick.
+    Either loads its own data from CSV files, or replays a MarketDataSource,
+    e.g. a shared MarketData.
+
+    By default every stock bar and every option timestamp is a tick. With
+    align_to_bars, only stock bars are ticks, and all option updates up to
+    each bar are folded into that bar's option chain.
     """
 
-    def __init__(self, stock_filename: str, option_filename: str):
-        # file handles
-        self.stock_reader = csv.DictReader(open(stock_filename, 'r'))
-        self.option_reader = csv.DictReader(open(option_filename, 'r'))
+    def __init__(self, stock_filename: str = "", option_filename: OptionSources = "",
+                 data: Optional[MarketDataSource] = None, align_to_bars: bool = False):
+        self.data = data or MarketData(stock_filename, option_filename)
+        self.align_to_bars = align_to_bars
 
-        # file iters
-        self.stock_iter: Iterator[StockData] = self._stock_generator()
-        self.option_iter: Iterator[tuple[datetime,
-                                         Dict[str, OptionData]]] = self._option_generator()
+        # data iters
+        self.stock_iter: Iterator[StockData] = iter(self.data.stocks)
+        self.option_iter: Iterator[tuple[int, Mapping[str, OptionData]]] = iter(
+            self.data.option_chains)
 
         # latest and next stock/options
         self.tick_count = 0
         self.latest_stock: StockData = StockData(
-            time=datetime.min,
+            time=0,
             open=0.0,
             high=0.0,
             low=0.0,
-            close=0.0
+            close=0.0,
+            day=-1
         )
-        self.latest_options: Dict[str, OptionData] = {}
+        self.latest_options = OptionChain()
+        self.option_version = 0
         self.next_stock = next(self.stock_iter, None)
         self.next_option_time, self.next_option_chain = next(
             self.option_iter, (None, {}))
 
-    def _stock_generator(self) -> Iterator[StockData]:
-        for row in self.stock_reader:
-            yield StockData(
-                time=datetime.fromtimestamp(
-                    int(row['time']), tz=ZoneInfo("America/Chicago")),
-                open=float(row['open']),
-                high=float(row['high']),
-                low=float(row['low']),
-                close=float(row['close'])
-            )
-
-    def _option_generator(self) -> Iterator[tuple[datetime, Dict[str, OptionData]]]:
-        current_time = None
-        chain: Dict[str, OptionData] = {}
-        for row in self.option_reader:
-            time = datetime.fromtimestamp(
-                int(row['timestamp']), tz=ZoneInfo("America/Chicago"))
-            symbol = row['contractSymbol']
-            data = OptionData(
-                time=time,
-                bid=float(row['bid']) if row['bid'] else 0,
-                ask=float(row['ask']) if row['bid'] else 0,
-                last=float(row['lastPrice']),
-                iv=float(row['impliedVolatility']),
-                volume=int(row['volume']) if row['volume'] else 0,
-            )
-            if current_time is None:
-                current_time = time
-
-            # check data quality
-            if data.bid == 0 and data.ask == 0:
-                print(
-                    f"Found 0x0 option quotes for {symbol} at {time}, please check data quality!")
-
-            # when we see a new timestamp, yield the current chain
-            if time != current_time:
-                yield current_time, chain
-                current_time = time
-                chain = {}
-
-            chain[symbol] = data
-
-        assert current_time
-        yield current_time, chain
+        # other underlyings, as of the latest tick
+        self.underlying_iters: List[Tuple[int, Iterator[StockData]]] = [
+            (self.data.symbol_index[symbol], iter(bars))
+            for symbol, bars in self.data.underlyings.items()]
+        self.next_underlyings: List[Optional[StockData]] = [
+            next(bars, None) for _, bars in self.underlying_iters]
+        self.prices = np.full(len(self.data.symbol_index), np.nan)
+        self.prices.flags.writeable = False
 
     @property
     def has_next_tick(self) -> bool:
@@ -116,13 +472,17 @@ class MarketDataLoader:
         return self.next_stock is not None
 
     @property
-    def next_tick_time(self) -> datetime:
+    def next_tick_time(self) -> int:
         """
         Find the next tick time based on the next stock and option times, whichever earlier.
         Caller must check has_next_tick before calling.
         """
         assert self.has_next_tick, "No more ticks available"
 
+        if self.align_to_bars:
+            assert self.next_stock
+            return self.next_stock.time
+
         next_times = []
         if self.next_stock:
             next_times.append(self.next_stock.time)
@@ -131,17 +491,27 @@ class MarketDataLoader:
 
         return min(next_times)
 
+    @property
+    def next_tick_day(self) -> int:
+        """
+        Session day of the next tick, precomputed for stock bars.
+        Caller must check has_next_tick before calling.
+        """
+        time = self.next_tick_time
+        if self.next_stock and self.next_stock.time == time:
+            return self.next_stock.day
+        return session_day(time)
+
     @property
     def end_of_day(self) -> bool:
         """
         Check if the next tick is on a different day.
         If there is no next tick, return True.
         """
-        # TODO: handle out of order ticks
         if not self.has_next_tick:
             return True
 
-        return self.next_tick_time.date() != self.latest_stock.time.date()
+        return self.next_tick_day != self.latest_stock.day
 
     def next_tick(self) -> TickData:
         """
@@ -153,21 +523,61 @@ class MarketDataLoader:
         time = self.next_tick_time
         self.tick_count += 1
 
+        # drop expired contracts even without new quotes
+        expiration = self.latest_options.next_expiration
+        if expiration and expiration < time:
+            self.latest_options = self.latest_options.updated({}, time)
+            self.option_version += 1
+
         # advance stock and/or option iterators
         if self.next_stock and self.next_stock.time == time:
             self.latest_stock = self.next_stock
             self.next_stock = next(self.stock_iter, None)
-        if self.next_option_time and self.next_option_time == time:
-            self.latest_options.update(self.next_option_chain)
+            if self.data.product:
+                self._set_price(self.data.symbol_index[self.data.product], self.latest_stock.open)
+        for i, (index, bars) in enumerate(self.underlying_iters):
+            bar = self.next_underlyings[i]
+            if bar and bar.time <= time:
+                while bar and bar.time <= time:
+                    latest = bar
+                    bar = next(bars, None)
+                self.next_underlyings[i] = bar
+                self._set_price(index, latest.open)
+        if self.align_to_bars:
+            # fold in all option updates up to this bar
+            changes: Dict[str, OptionData] = {}
+            while self.next_option_time and self.next_option_time <= time:
+                changes.update(self.next_option_chain)
+                self.next_option_time, self.next_option_chain = next(
+                    self.option_iter, (None, {}))
+            if changes:
+                self.latest_options = self.latest_options.updated(
+                    changes, time)
+                self.option_version += 1
+        elif self.next_option_time and self.next_option_time == time:
+            self.latest_options = self.latest_options.updated(
+                self.next_option_chain, time)
+            self.option_version += 1
             self.next_option_time, self.next_option_chain = next(
                 self.option_iter, (None, {}))
 
         return TickData(
             time=time,
+            day=self.latest_stock.day if self.latest_stock.time == time else session_day(time),
             stock_price=self.latest_stock,
-            option_prices=self.latest_options
+            option_prices=self.latest_options,
+            option_version=self.option_version,
+            prices=self.prices,
+            symbol_index=self.data.symbol_index
         )
 
+    def _set_price(self, index: int, price: float):
+        # copy on write, earlier ticks keep their prices
+        if self.prices[index] != price:
+            self.prices = self.prices.copy()
+            self.prices[index] = price
+            self.prices.flags.writeable = False
+
 
 if __name__ == "__main__":
     # Example usage
@@ -177,4 +587,4 @@ if __name__ == "__main__":
     )
     while md.has_next_tick:
         tick = md.next_tick()
-        print(tick.time, tick.stock_price.open, len(tick.option_prices))
+        print(to_datetime(tick.time), tick.stock_price.open, len(tick.option_prices))
@@ -0,0 +1,268 @@
+import argparse
+import glob
+import os
+import random
+import shutil
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from time import perf_counter, sleep
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import yfinance_scraper as scraper
+from cache import load_option_columns
+from clock import session_day, to_date
+from instrument import parse_symbol
+from log import logger
+
+LOG_PATH = "tmp/yahoo_replay.log"
+
+
+class RecordedChains:
+    """
+    Option quotes recorded by the scraper, replayed as Yahoo would have listed
+    them at a given time: the latest quote of every contract traded by then.
+    """
+
+    def __init__(self, filenames: List[str]):
+        times, symbols, bids, asks, lasts, ivs, volumes = [], [], [], [], [], [], []
+        for filename in filenames:
+            columns = load_option_columns(filename)
+            times.append(np.asarray(columns.time))
+            symbols.append(np.asarray(columns.symbols)[columns.symbol])
+            bids.append(np.asarray(columns.bid))
+            asks.append(np.asarray(columns.ask))
+            lasts.append(np.asarray(columns.last))
+            ivs.append(np.asarray(columns.iv))
+            volumes.append(np.asarray(columns.volume))
+        time = np.concatenate(times)
+        # time-sorted, file order on ties
+        order = np.argsort(time, kind="stable")
+        self.time = time[order]
+        self.symbols, symbol = np.unique(np.concatenate(symbols)[order], return_inverse=True)
+        self.symbol = symbol.astype(np.int32)
+        self.bid = np.concatenate(bids)[order]
+        self.ask = np.concatenate(asks)[order]
+        self.last = np.concatenate(lasts)[order]
+        self.iv = np.concatenate(ivs)[order]
+        self.volume = np.concatenate(volumes)[order]
+        # per contract: expiry date as Yahoo lists it, call or put, strike
+        contracts = [parse_symbol(symbol) for symbol in self.symbols.tolist()]
+        self.expiries = np.array([str(to_date(session_day(expiration)))
+                                  for _, expiration, _, _ in contracts])
+        self.calls = np.array([call for _, _, call, _ in contracts])
+        self.strikes = np.array([strike for _, _, _, strike in contracts])
+
+        # rows by contract then time, file order kept on ties, searched by
+        # contract * span + time so every request is one searchsorted
+        self.by_contract = np.lexsort((self.time, self.symbol))
+        self.start_time = int(self.time[0]) if len(self.time) else 0
+        self.span = int(self.time[-1]) - self.start_time + 1 if len(self.time) else 1
+        self.keys = self.symbol[self.by_contract].astype(np.int64) * self.span + \
+            (self.time[self.by_contract] - self.start_time)
+        # first row of every contract in by_contract, each contract has at least one
+        self.contract_starts = np.searchsorted(
+            self.symbol[self.by_contract], np.arange(len(self.symbols)))
+        # (expiry, call) -> contracts sorted by strike
+        groups: Dict[Tuple[str, bool], List[int]] = {}
+        for contract in np.lexsort((self.strikes, self.calls, self.expiries)).tolist():
+            key = (self.expiries[contract], bool(self.calls[contract]))
+            groups.setdefault(key, []).append(contract)
+        self.contracts = {key: np.array(ids, dtype=np.int64) for key, ids in groups.items()}
+        # expiry -> time of its first quote
+        self.first_quotes: Dict[str, int] = {}
+        first_times = self.time[self.by_contract[self.contract_starts]]
+        for expiry, first in zip(self.expiries.tolist(), first_times.tolist()):
+            self.first_quotes[expiry] = min(first, self.first_quotes.get(expiry, first))
+
+    def latest(self, time: int, contracts: np.ndarray) -> np.ndarray:
+        """
+        Row index of the latest quote at or before time of each given contract
+        that has one, O(contracts * log rows).
+        """
+        offset = min(max(time - self.start_time, -1), self.span - 1)
+        rows = np.searchsorted(self.keys, contracts * self.span + offset, side="right") - 1
+        # a row before the contract's first belongs to the previous contract
+        return self.by_contract[rows[rows >= self.contract_starts[contracts]]]
+
+    def expirations(self, time: int, today: str) -> Tuple[str, ...]:
+        return tuple(sorted(expiry for expiry, first in self.first_quotes.items()
+                            if first <= time and expiry >= today))
+
+    def chain(self, time: int, expiry: str, call: bool) -> pd.DataFrame:
+        rows = self.latest(time, self.contracts.get((expiry, call), np.empty(0, dtype=np.int64)))
+        contract = self.symbol[rows]
+        return pd.DataFrame({
+            "contractSymbol": self.symbols[contract],
+            "lastTradeDate": pd.to_datetime(self.time[rows], unit="s", utc=True),
+            "strike": self.strikes[contract],
+            "lastPrice": self.last[rows],
+            "bid": self.bid[rows],
+            "ask": self.ask[rows],
+            "volume": self.volume[rows].astype(np.float64),
+            "impliedVolatility": self.iv[rows],
+        })
+
+
+class Chain(NamedTuple):
+    calls: pd.DataFrame
+    puts: pd.DataFrame
+
+
+@dataclass
+class Faults:
+    """
+    Injected request latency and failures.
+    """
+    latency: float = 0.2  # seconds per request
+    jitter: float = 0.5  # latency is scaled by 1 +- jitter
+    failure_rate: float = 0.0  # requests raising ConnectionError
+    slow_rate: float = 0.0  # requests taking slow_latency, e.g. past REQUEST_TIMEOUT
+    slow_latency: float = 30.0
+
+
+@dataclass
+class ReplayStats:
+    """
+    Requests served per symbol, and how many of them failed or were slow.
+    """
+    requests: Dict[str, int] = field(default_factory=dict)
+    failures: Dict[str, int] = field(default_factory=dict)
+    slow: Dict[str, int] = field(default_factory=dict)
+
+
+class ReplayClock(scraper.Clock):
+    """
+    Simulated time for the polling loop, sleeping advances it instantly.
+    """
+
+    def __init__(self, start: datetime):
+        self.time = start
+
+    def now(self) -> datetime:
+        return self.time
+
+    def sleep(self, seconds: float):
+        self.time += timedelta(seconds=seconds)
+
+
+class ReplayYahoo:
+    """
+    Stand-in for yf.Ticker serving recorded chains as of the clock's time, a
+    TickerFactory for the scraper. Requests sleep for the injected latency on
+    the caller's thread and may fail, like network calls would.
+    """
+
+    def __init__(self, chains: Dict[str, RecordedChains], clock: scraper.Clock,
+                 faults: Optional[Faults] = None, seed: Optional[int] = None):
+        self.chains = chains
+        self.clock = clock
+        self.faults = faults or Faults()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = ReplayStats()
+
+    def __call__(self, symbol: str) -> "ReplayTicker":
+        return ReplayTicker(self, symbol)
+
+    def request(self, symbol: str):
+        faults = self.faults
+        with self.lock:
+            self.stats.requests[symbol] = self.stats.requests.get(symbol, 0) + 1
+            slow = self.random.random() < faults.slow_rate
+            fail = self.random.random() < faults.failure_rate
+            latency = faults.slow_latency if slow else \
+                faults.latency * self.random.uniform(1 - faults.jitter, 1 + faults.jitter)
+            if slow:
+                self.stats.slow[symbol] = self.stats.slow.get(symbol, 0) + 1
+            if fail:
+                self.stats.failures[symbol] = self.stats.failures.get(symbol, 0) + 1
+        sleep(latency)
+        if fail:
+            raise ConnectionError(f"injected failure for {symbol}")
+
+
+class ReplayTicker:
+    """
+    The part of the yf.Ticker interface the scraper uses.
+    """
+
+    def __init__(self, yahoo: ReplayYahoo, symbol: str):
+        self.yahoo = yahoo
+        self.symbol = symbol
+        self.chains = yahoo.chains.get(symbol)
+
+    @property
+    def options(self) -> Tuple[str, ...]:
+        self.yahoo.request(self.symbol)
+        if self.chains is None:
+            # yfinance lists no expirations for unknown symbols
+            return ()
+        now = self.yahoo.clock.now()
+        return self.chains.expirations(int(now.timestamp()), str(now.date()))
+
+    def option_chain(self, expiry: str) -> Chain:
+        self.yahoo.request(self.symbol)
+        if self.chains is None:
+            raise ValueError(f"No options for {self.symbol}")
+        time = int(self.yahoo.clock.now().timestamp())
+        return Chain(self.chains.chain(time, expiry, True), self.chains.chain(time, expiry, False))
+
+
+def recorded_files(pattern: str = "data/*-options*.csv") -> Dict[str, List[str]]:
+    """
+    Recorded option files by symbol, e.g. data/SPY-options-....csv is SPY.
+    """
+    files: Dict[str, List[str]] = {}
+    for filename in sorted(glob.glob(pattern)):
+        files.setdefault(os.path.basename(filename).split("-")[0], []).append(filename)
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scraper polling loop against recorded chains on simulated time.")
+    parser.add_argument("--start", default="2025-07-07T09:00",
+                        help="simulated start time, CT")
+    parser.add_argument("--polls", type=int, default=10)
+    parser.add_argument("--symbols", nargs="+", default=None,
+                        help="default: every symbol with a recorded option file")
+    parser.add_argument("--latency", type=float, default=Faults.latency)
+    parser.add_argument("--jitter", type=float, default=Faults.jitter)
+    parser.add_argument("--failure-rate", type=float, default=Faults.failure_rate)
+    parser.add_argument("--slow-rate", type=float, default=Faults.slow_rate)
+    parser.add_argument("--slow-latency", type=float, default=Faults.slow_latency)
+    parser.add_argument("--timeout", type=float, default=scraper.REQUEST_TIMEOUT,
+                        help="scraper request timeout, seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default="tmp/replay",
+                        help="scraper output, cleared first")
+    args = parser.parse_args()
+
+    files = recorded_files()
+    symbols = args.symbols or list(files)
+    chains = {symbol: RecordedChains(files[symbol]) for symbol in symbols if symbol in files}
+    clock = ReplayClock(datetime.fromisoformat(args.start).replace(tzinfo=scraper.TIMEZONE))
+    faults = Faults(args.latency, args.jitter, args.failure_rate, args.slow_rate, args.slow_latency)
+    yahoo = ReplayYahoo(chains, clock, faults, args.seed)
+    shutil.rmtree(args.data_dir, ignore_errors=True)
+    os.makedirs(args.data_dir)
+    logger.open(LOG_PATH)
+
+    start = perf_counter()
+    polls = scraper.run(clock, symbols, yahoo, scraper.LastSeen(None), args.data_dir, args.polls,
+                        args.timeout)
+    elapsed = perf_counter() - start
+    logger.close()
+
+    seconds = np.array([poll.seconds for poll in polls])
+    print(f"{len(polls)} polls in {elapsed:.2f}s, poll latency "
+          f"mean {seconds.mean():.2f}s, p50 {np.median(seconds):.2f}s, max {seconds.max():.2f}s")
+    for symbol in symbols:
+        rows = sum(poll.rows.get(symbol, 0) for poll in polls)
+        requests = yahoo.stats.requests.get(symbol, 0)
+        print(f"{symbol}: {rows} rows, {rows / seconds.sum():.0f} rows/s, {requests} requests, "
+              f"{yahoo.stats.failures.get(symbol, 0)} failed, {yahoo.stats.slow.get(symbol, 0)} slow")
@@ -1,10 +1,16 @@
+import asyncio
 import os
-import yfinance as yf
+import random
+import numpy as np
 import pandas as pd
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import perf_counter, sleep
 from datetime import datetime, timedelta, time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
 from zoneinfo import ZoneInfo
 from log import logger
+import optionstore
 
 LOG_PATH = "tmp/yfinance_scraper.log"
 SYMBOLS = ["SPY", "QQQ"]
@@ -12,115 +18,311 @@ DTE_RANGE = 7
 TIME_OPEN = time(9, 00, 00)  # yfinance does not show quotes until 9:00 AM CT
 TIME_CLOSE = time(15, 15, 59)  # market closes at 3:15 PM CT
 PERIOD = 15  # scrape every PERIOD minutes
+MAX_TRADE_AGE = timedelta(hours=8)  # older last trades are stale quotes
+DATA_DIR = "data"
+LAST_SEEN_PATH = "data/.last-seen.csv"  # dedup cache, survives restarts
+TIMEZONE = ZoneInfo("America/Chicago")
+EPOCH = pd.Timestamp(0, tz="UTC")
 
+# fetch pipeline
+MAX_CONCURRENT_REQUESTS = 8  # across all symbols and expirations
+REQUEST_TIMEOUT = 20.0  # seconds per request
+MAX_ATTEMPTS = 3  # per request
+RETRY_DELAY = 1.0  # seconds before the first retry, doubled on every retry, +-50% jitter
 
-# cache last seen trade ts to avoid duplicates
-lastTimestamp = {}
+T = TypeVar("T")
 
+# symbol -> object with the yf.Ticker interface, i.e. `options` and `option_chain(expiry)`
+type TickerFactory = Callable[[str], Any]
 
-def has_new_trade(row):
-    instrument = row["contractSymbol"]
-    last = lastTimestamp.get(instrument)
-    return pd.isna(last) or row["timestamp"] > last
 
+def yahoo_ticker(symbol: str) -> Any:
+    import yfinance as yf
+    return yf.Ticker(symbol)
 
-def quote_price_valid(row):
-    if pd.isna(row["bid"]) or pd.isna(row["ask"]):
-        return False
-    bid = float(row["bid"])
-    ask = float(row["ask"])
-    return bid < ask and bid >= 0
 
+class LastSeen:
+    """
+    Last seen trade timestamp (epoch seconds) per contract, to avoid appending
+    duplicates. Persisted to a CSV after every poll so a restart does not
+    re-append the day's rows.
+    """
 
-def save_realtime_data_1symbol(symbol: str):
-    spy = yf.Ticker(symbol)
-    now = datetime.now(ZoneInfo("America/Chicago"))
+    def __init__(self, path: Optional[str] = LAST_SEEN_PATH):
+        self.path = path
+        self.timestamps = pd.Series(dtype="int64", name="timestamp")
+        if path and os.path.exists(path):
+            df = pd.read_csv(path, index_col="contractSymbol")
+            self.timestamps = df["timestamp"].astype("int64")
+
+    def new_trades(self, contracts: pd.Series, timestamps: pd.Series) -> pd.Series:
+        """
+        Mask of the rows traded after the last seen trade of their contract.
+        """
+        last = self.timestamps.reindex(contracts.to_numpy()).to_numpy()
+        return pd.Series(pd.isna(last) | (timestamps.to_numpy() > last), index=contracts.index)
+
+    def update(self, contracts: pd.Series, timestamps: pd.Series):
+        seen = timestamps.groupby(contracts.to_numpy()).max()
+        self.timestamps = seen.combine_first(self.timestamps).astype("int64")
+
+    def save(self, cutoff: int):
+        """
+        Persist the contracts traded at or after cutoff, older trades are filtered
+        out by the cutoff anyway.
+        """
+        self.timestamps = self.timestamps[self.timestamps >= cutoff]
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        self.timestamps.rename_axis("contractSymbol").to_csv(tmp_path)
+        os.replace(tmp_path, self.path)
+
+
+def epoch_seconds(timestamps: pd.Series) -> pd.Series:
+    """
+    Epoch seconds of a datetime column, whatever its resolution. Naive times are UTC.
+    """
+    return (pd.to_datetime(timestamps, utc=True) - EPOCH) // pd.Timedelta(seconds=1)
+
+
+def quote_price_valid(df: pd.DataFrame) -> pd.Series:
+    bid = pd.to_numeric(df["bid"], errors="coerce")
+    ask = pd.to_numeric(df["ask"], errors="coerce")
+    # comparisons with NaN are False
+    return (bid < ask) & (bid >= 0)
+
+
+# loaded on the first poll
+default_last_seen: Optional[LastSeen] = None
+
+
+class Fetcher:
+    """
+    Runs blocking requests on a thread pool with bounded concurrency, a timeout per
+    request and jittered exponential backoff between attempts.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+                 timeout: float = REQUEST_TIMEOUT):
+        self.limit = asyncio.Semaphore(max_concurrent)
+        self.timeout = timeout
+        # a timed out request keeps its thread until it returns, leave room for the retries
+        self.executor = ThreadPoolExecutor(max_concurrent * MAX_ATTEMPTS)
+
+    async def fetch(self, call: Callable[[], T], what: str) -> T:
+        """
+        Raises the last error if all attempts fail.
+        """
+        loop = asyncio.get_running_loop()
+        attempt = 1
+        while True:
+            try:
+                async with self.limit:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(self.executor, call), self.timeout)
+            except Exception as e:
+                logger.error("Error fetching %s (attempt %d/%d): %r",
+                             what, attempt, MAX_ATTEMPTS, e)
+                if attempt == MAX_ATTEMPTS:
+                    raise
+            await asyncio.sleep(RETRY_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    def close(self):
+        # do not wait for abandoned requests
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def fetch_symbol(symbol: str, ticker_factory: TickerFactory, now: datetime,
+                       fetcher: Fetcher) -> List[pd.DataFrame]:
+    """
+    Fetch the call and put chains of every expiration within DTE_RANGE concurrently.
+    Expirations failing all attempts are skipped.
+    """
+    ticker = ticker_factory(symbol)
 
     # determine expirations within the DTE range
+    options = await fetcher.fetch(lambda: ticker.options, f"{symbol} expirations")
     expirations = [
-        date for date in spy.options
+        date for date in options
         if 0 <= (datetime.strptime(date, "%Y-%m-%d").date() - now.date()).days <= DTE_RANGE
     ]
-    logger.info(
-        f"Fetching data for {len(expirations)} {symbol} expirations: {expirations}")
+    logger.info("Fetching data for %d %s expirations: %s",
+                len(expirations), symbol, expirations)
 
     # fetch option chains for each expiration
+    chains = await asyncio.gather(
+        *(fetcher.fetch(lambda expiry=expiry: ticker.option_chain(expiry), f"{symbol} {expiry}")
+          for expiry in expirations),
+        return_exceptions=True)
     data = []
-    cutoff = now - timedelta(hours=8)
-    for expiry in expirations:
-        opt_chain = spy.option_chain(expiry)
-        calls = opt_chain.calls.copy()
-        puts = opt_chain.puts.copy()
-        for df in (calls, puts):
-            df.rename(columns={
-                "lastTradeDate": "timestamp",
-            }, inplace=True)
-            # only keep rows that satisfy ALL of the following:
-            # 1. timestamp is within 8h
-            # 2. timestamp is newer than cache
-            # 3. bid and ask are not both 0
-            df = df[df["timestamp"] >= cutoff]
-            df = df[df.apply(has_new_trade, axis=1)]
-            df = df[df.apply(quote_price_valid, axis=1)]
-            data.append(df)
-            # update cache
-            for _, row in df.iterrows():
-                lastTimestamp[row["contractSymbol"]] = row["timestamp"]
+    for expiry, chain in zip(expirations, chains):
+        if isinstance(chain, BaseException):
+            logger.error("Skipping %s %s: %r", symbol, expiry, chain)
+            continue
+        data.extend((chain.calls.copy(), chain.puts.copy()))
+    return data
+
+
+async def fetch_all(symbols: List[str], ticker_factory: TickerFactory, now: datetime,
+                    timeout: float = REQUEST_TIMEOUT) -> Dict[str, List[pd.DataFrame]]:
+    """
+    Fetch all symbols concurrently, at most MAX_CONCURRENT_REQUESTS requests in flight.
+    Symbols whose expiration list cannot be fetched are left out.
+    """
+    fetcher = Fetcher(timeout=timeout)
+    try:
+        results = await asyncio.gather(
+            *(fetch_symbol(symbol, ticker_factory, now, fetcher) for symbol in symbols),
+            return_exceptions=True)
+    finally:
+        fetcher.close()
+    chains = {}
+    for symbol, result in zip(symbols, results):
+        if isinstance(result, BaseException):
+            logger.error("Skipping %s: %r", symbol, result)
+            continue
+        chains[symbol] = result
+    return chains
+
+
+def save_chains(symbol: str, chains: List[pd.DataFrame], now: datetime, last_seen: LastSeen,
+                data_dir: str = DATA_DIR) -> int:
+    """
+    Append new trades with a valid quote to the option store {data_dir}/{symbol}-options/.
+    Returns the number of rows appended.
+    """
+    if not chains:
+        logger.info("No option chains for %s", symbol)
+        return 0
 
     # consolidate put/call data into a single DataFrame
-    df = pd.concat(data, ignore_index=True)
-    # filter columns
-    interested_cols = ["timestamp", "contractSymbol", "bid", "ask",
-                       "lastPrice", "impliedVolatility", "volume"]
-    df = df[interested_cols]
-    df["timestamp"] = df["timestamp"].astype(int) // 10**9
-    df['impliedVolatility'] = df['impliedVolatility'].round(5)
-    df['volume'] = df['volume'].fillna(0).astype(int)
-
-    # save to CSV
-    path = f"data/{symbol}-options.csv"
-    file_exists = os.path.exists(path)
-    df.to_csv(path, mode='a', header=not file_exists, index=False)
-    logger.info(f"Appended {len(df)} rows to {path}")
-
-
-def save_realtime_data():
-    for symbol in SYMBOLS:
-        # retry 3 times in case of failure
-        for _ in range(3):
-            try:
-                save_realtime_data_1symbol(symbol)
-                break  # success, exit retry loop
-            except Exception as e:
-                logger.error(f"Error fetching data for {symbol}: {e}")
-                sleep(5)  # wait before retrying
+    df = pd.concat(chains, ignore_index=True)
+    df["timestamp"] = epoch_seconds(df["lastTradeDate"])
+    # only keep rows that satisfy ALL of the following:
+    # 1. timestamp is within MAX_TRADE_AGE
+    # 2. timestamp is newer than cache
+    # 3. bid and ask are not both 0
+    cutoff = int((now - MAX_TRADE_AGE).timestamp())
+    df = df[df["timestamp"] >= cutoff]
+    df = df[last_seen.new_trades(df["contractSymbol"], df["timestamp"]) & quote_price_valid(df)]
+    df = df.drop_duplicates(["contractSymbol", "timestamp"])
+    # update cache
+    last_seen.update(df["contractSymbol"], df["timestamp"])
+
+    # columnar rows for the option store
+    codes, symbols = pd.factorize(df["contractSymbol"])
+    columns = {
+        "time": df["timestamp"].to_numpy(dtype=np.int64),
+        "symbol": codes.astype(np.int32),
+        "bid": df["bid"].fillna(0).to_numpy(dtype=np.float64),
+        "ask": df["ask"].fillna(0).to_numpy(dtype=np.float64),
+        "last": df["lastPrice"].to_numpy(dtype=np.float64),
+        "iv": df["impliedVolatility"].round(5).to_numpy(dtype=np.float64),
+        "volume": df["volume"].fillna(0).to_numpy(dtype=np.int64),
+        "symbols": np.asarray(symbols, dtype=str),
+    }
+
+    # append to the symbol's partitioned store
+    path = optionstore.store_path(symbol, data_dir)
+    optionstore.append(path, columns)
+    logger.info("Appended %d rows to %s", len(df), path)
+    return len(df)
+
+
+def save_realtime_data(symbols: List[str] = SYMBOLS, ticker_factory: TickerFactory = yahoo_ticker,
+                       now: Optional[datetime] = None, last_seen: Optional[LastSeen] = None,
+                       data_dir: str = DATA_DIR, timeout: float = REQUEST_TIMEOUT) -> Dict[str, int]:
+    """
+    One poll: fetch every symbol and expiration concurrently, then save the new rows.
+    The dedup cache defaults to the one persisted at LAST_SEEN_PATH.
+    Returns the rows appended per fetched symbol.
+    """
+    global default_last_seen
+    if last_seen is None:
+        if default_last_seen is None:
+            default_last_seen = LastSeen()
+        last_seen = default_last_seen
+    now = now or datetime.now(TIMEZONE)
+    chains = asyncio.run(fetch_all(symbols, ticker_factory, now, timeout))
+    rows = {symbol: save_chains(symbol, data, now, last_seen, data_dir)
+            for symbol, data in chains.items()}
+    last_seen.save(int((now - MAX_TRADE_AGE).timestamp()))
+    return rows
+
+
+class Clock:
+    """
+    Wall clock of the polling loop. Replace it to run the loop on simulated time,
+    see yahoo_replay.py.
+    """
+
+    def now(self) -> datetime:
+        return datetime.now(TIMEZONE)
+
+    def sleep(self, seconds: float):
+        sleep(seconds)
+
+
+def market_open(now: datetime) -> bool:
+    return now.weekday() < 5 and TIME_OPEN <= now.time() <= TIME_CLOSE
+
+
+def next_poll_time(now: datetime) -> datetime:
+    """
+    The next PERIOD-minute moment after now (e.g. 00, 15, 30, 45).
+    """
+    minute = (now.minute // PERIOD + 1) * PERIOD
+    if minute == 60:
+        # next hour
+        return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    return now.replace(minute=minute, second=0, microsecond=0)
+
+
+@dataclass
+class PollStats:
+    """
+    One poll of the polling loop.
+    """
+    time: datetime
+    seconds: float  # elapsed wall time of the poll
+    rows: Dict[str, int]  # rows appended per fetched symbol
+
+
+def run(clock: Optional[Clock] = None, symbols: List[str] = SYMBOLS,
+        ticker_factory: TickerFactory = yahoo_ticker, last_seen: Optional[LastSeen] = None,
+        data_dir: str = DATA_DIR, polls: Optional[int] = None,
+        timeout: float = REQUEST_TIMEOUT) -> List[PollStats]:
+    """
+    Poll every PERIOD minutes during market hours, forever or until polls polls are done.
+    Runs on the wall clock unless given another clock.
+    """
+    clock = clock or Clock()
+    stats: List[PollStats] = []
+    while True:
+        now = clock.now()
+        logger.settime(int(now.timestamp()))
+
+        # check market hours
+        if market_open(now):
+            start = perf_counter()
+            rows = save_realtime_data(symbols, ticker_factory, now, last_seen, data_dir, timeout)
+            stats.append(PollStats(now, perf_counter() - start, rows))
+            logger.info("Poll took %.2fs, appended %s", stats[-1].seconds, rows)
+            if polls is not None and len(stats) == polls:
+                break
+
+        # sleep until the next poll
+        next_run = next_poll_time(clock.now())
+        logger.info("Sleeping till next invocation at %s", next_run)
+        logger.flush()  # flush log before sleeping
+        clock.sleep(max((next_run - clock.now()).total_seconds(), 0))
+    return stats
 
 
 if __name__ == "__main__":
     logger.open(LOG_PATH)
     print(
         f"Polling every {PERIOD} minute between {TIME_OPEN} and {TIME_CLOSE} CT...")
-    while True:
-        now = datetime.now(ZoneInfo("America/Chicago"))
-        logger.settime(now)
-        assert logger.file
-
-        # check market hours
-        if now.weekday() < 5 and TIME_OPEN <= now.time() <= TIME_CLOSE:
-            save_realtime_data()
-
-        # sleep until the next PERIOD-minute moment (e.g. 00, 15, 30, 45)
-        now = datetime.now(ZoneInfo("America/Chicago"))
-        minute = (now.minute // PERIOD + 1) * PERIOD
-        if minute == 60:
-            # next hour
-            next_run = now.replace(
-                minute=0, second=0, microsecond=0) + timedelta(hours=1)
-        else:
-            next_run = now.replace(minute=minute, second=0, microsecond=0)
-        logger.info(
-            f"Sleeping till next invocation at {next_run.astimezone(ZoneInfo('America/Chicago'))}")
-        sleep_time = (
-            next_run - datetime.now(ZoneInfo("America/Chicago"))).total_seconds()
-        logger.file.flush()  # flush log before sleeping
-        sleep(max(sleep_time, 0))
+    run()